@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import pathlib
+import shutil
+import time
+import urllib.parse
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Generator, Optional
+
+from albion_calculator_backend import config, metrics
+from albion_calculator_backend.models import CalculationsUpdateRecord, ProfitDetailsRecord, IngredientDetailsRecord
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# every generation of calculations written as columnar files for analytics, so they never query the serving database
+
+_EXPORT_CONFIG = config.CONFIG['APP'].get('EXPORT', {})
+
+_ENABLED = _EXPORT_CONFIG.get('ENABLED', False)
+_DIRECTORY = pathlib.Path(__file__).parent / _EXPORT_CONFIG.get('DIRECTORY', 'cache/calculations_export')
+_FORMAT = _EXPORT_CONFIG.get('FORMAT', 'parquet')
+_RETENTION_DAYS = _EXPORT_CONFIG.get('RETENTION_DAYS', 7)
+_KEEP_AT_LEAST = _EXPORT_CONFIG.get('KEEP_AT_LEAST', 2)
+# generations are written next to the exported ones and renamed when complete, readers never see partial ones
+_TEMPORARY_PREFIX = '.tmp-'
+_MANIFEST_FILE = 'manifest.json'
+
+_PROFIT_FIELDS = [name for name in ProfitDetailsRecord._fields if name != 'ingredients_details']
+_INGREDIENT_FIELDS = list(IngredientDetailsRecord._fields)
+
+# temporary directory of the generation being written and rows written into it per partition
+_current_generation: Optional[pathlib.Path] = None
+_partitions: dict[str, int] = {}
+
+
+def is_enabled() -> bool:
+    if _ENABLED and pyarrow is None:
+        logging.warning('Calculations export is enabled but pyarrow is not installed')
+    return _ENABLED and pyarrow is not None
+
+
+@contextmanager
+def generation(price_generation: int) -> Generator[None, None, None]:
+    # everything exported inside becomes visible at once, nothing if calculations fail or are interrupted;
+    # errors of the export itself are only logged, they never stop calculations from being saved
+    name = f'{datetime.now().strftime("%Y-%m-%dT%H-%M-%S")}_{price_generation}'
+    if is_enabled():
+        _start_generation(name)
+    try:
+        yield
+    except BaseException:
+        _discard_generation()
+        raise
+    _complete_generation(name, price_generation)
+
+
+def export(calculations_update: CalculationsUpdateRecord) -> None:
+    if _current_generation is None or not calculations_update.profit_details:
+        return
+    try:
+        with metrics.span('export_calculations', key=calculations_update.type_key):
+            _export_partitions(calculations_update)
+    except Exception:
+        logging.exception(f'Export of {calculations_update.type_key} failed, calculations of this run not exported')
+        _discard_generation()
+
+
+def _start_generation(name: str) -> None:
+    global _current_generation, _partitions
+    try:
+        _current_generation, _partitions = _DIRECTORY / f'{_TEMPORARY_PREFIX}{name}', {}
+        _current_generation.mkdir(parents=True)
+    except OSError:
+        logging.exception('Calculations export could not be started')
+        _current_generation = None
+
+
+def _complete_generation(name: str, price_generation: int) -> None:
+    if _current_generation is None:
+        return
+    try:
+        _write_manifest(_current_generation, name, price_generation)
+        os.replace(_current_generation, _DIRECTORY / name)
+        logging.info(f'Calculations exported to {_DIRECTORY / name}')
+        _remove_old_generations()
+    except OSError:
+        logging.exception('Exported calculations could not be completed')
+    finally:
+        _discard_generation()
+
+
+def _discard_generation() -> None:
+    global _current_generation
+    if _current_generation is not None:
+        shutil.rmtree(_current_generation, ignore_errors=True)
+    _current_generation = None
+
+
+def _export_partitions(calculations_update: CalculationsUpdateRecord) -> None:
+    profit_table, ingredient_table = _create_tables(calculations_update.profit_details)
+    # row indexes of every category, ingredients follow rows of their products
+    profit_rows, ingredient_rows = {}, {}
+    for row, profit_details in enumerate(calculations_update.profit_details):
+        profit_rows.setdefault(profit_details.product_subcategory_id, []).append(row)
+    for ingredient_row, profit_row in enumerate(ingredient_table.column('profit_row').to_pylist()):
+        category = calculations_update.profit_details[profit_row].product_subcategory_id
+        ingredient_rows.setdefault(category, []).append(ingredient_row)
+    for category, rows in profit_rows.items():
+        partition = f'type_key={_quote(calculations_update.type_key)}/category={_quote(category)}'
+        _write_table(profit_table.take(rows), f'profit_details/{partition}')
+        _write_table(ingredient_table.take(ingredient_rows.get(category, [])), f'ingredient_details/{partition}')
+        _partitions[partition] = len(rows)
+
+
+def _create_tables(profit_details: list[ProfitDetailsRecord]) -> tuple['pyarrow.Table', 'pyarrow.Table']:
+    # column by column from the records, rows of the table are ranked like the saved ones
+    profit_columns = dict(zip(ProfitDetailsRecord._fields, zip(*profit_details)))
+    profit_columns['recipe_type'] = [recipe_type.value for recipe_type in profit_columns['recipe_type']]
+    profit_table = pyarrow.table({'row': range(len(profit_details)),
+                                  **{name: profit_columns[name] for name in _PROFIT_FIELDS}})
+    ingredients = [(row, *ingredient) for row, details in enumerate(profit_details)
+                   for ingredient in details.ingredients_details]
+    ingredient_columns = zip(*ingredients) if ingredients else [[]] * (len(_INGREDIENT_FIELDS) + 1)
+    ingredient_table = pyarrow.table(dict(zip(['profit_row', *_INGREDIENT_FIELDS], ingredient_columns)))
+    return profit_table, ingredient_table
+
+
+def _write_table(table: 'pyarrow.Table', partition: str) -> None:
+    directory = _current_generation / partition
+    directory.mkdir(parents=True, exist_ok=True)
+    if _FORMAT == 'arrow':
+        pyarrow.feather.write_feather(table, directory / 'part-0.arrow')
+    else:
+        pyarrow.parquet.write_table(table, directory / 'part-0.parquet')
+
+
+def _quote(value: str) -> str:
+    # hive style partition values, decoded by pyarrow.dataset and most query engines
+    return urllib.parse.quote(str(value), safe='')
+
+
+def _write_manifest(directory: pathlib.Path, name: str, price_generation: int) -> None:
+    with open(directory / _MANIFEST_FILE, 'w') as f:
+        json.dump({'generation': name, 'price_generation': price_generation, 'format': _FORMAT,
+                   'created': datetime.now().isoformat(timespec='seconds'), 'rows': _partitions}, f, indent=1)
+
+
+def _remove_old_generations() -> None:
+    # the newest generations are kept regardless of their age, temporary directories left by crashes are removed
+    generations = sorted((path for path in _DIRECTORY.iterdir() if path.is_dir()), key=lambda path: path.name)
+    exported = [path for path in generations if not path.name.startswith(_TEMPORARY_PREFIX)]
+    oldest_kept = time.time() - _RETENTION_DAYS * 24 * 3600
+    expired = [path for path in exported[:-_KEEP_AT_LEAST or None] if path.stat().st_mtime < oldest_kept]
+    abandoned = [path for path in generations if path.name.startswith(_TEMPORARY_PREFIX)
+                 and path != _current_generation and path.stat().st_mtime < time.time() - 24 * 3600]
+    for path in expired + abandoned:
+        shutil.rmtree(path, ignore_errors=True)
+        logging.debug(f'Exported calculations {path.name} removed')
@@ -0,0 +1,84 @@
+import json
+import logging
+import os
+import pathlib
+from datetime import datetime
+
+from sqlalchemy.orm import Query
+
+import albion_calculator_web.database
+from albion_calculator_backend import config, cities
+from albion_calculator_backend.items_parser import ITEMS_JSON_FILE
+
+# reading saved calculations needs no game data, keep heavy modules (items, market, numpy...) out of this one
+
+_CRAFTINGMODIFIERS_FILE = pathlib.Path(__file__).parent / 'resources/craftingmodifiers.json'
+
+_CATEGORIES_FILE = pathlib.Path(__file__).parent / config.CONFIG['APP']['WEBAPP'].get(
+    'CATEGORIES_FILE', 'cache/craftable_categories.json')
+
+ONE_TILE = config.CONFIG['APP']['CALCULATOR']['TRAVEL_COST_ONE_TILE']
+
+TWO_TILES = ONE_TILE ** 2
+
+
+def get_calculations(recipe_type: str, limitation: str, city_index: int, use_focus: bool,
+                     category: str, min_volume: float = 0,
+                     ranking: str = 'PROFIT_PERCENTAGE') -> tuple[Query, datetime]:
+    key = create_calculation_key(limitation, recipe_type, use_focus)
+    key = key if not limitation == 'PER_CITY' else f'{key} + {cities.city_at_index(city_index).upper().replace(" ", "_")}'
+    profit_details, update_time = albion_calculator_web.database.find_calculations_for_key_and_category(
+        key, category, min_volume, ranking)
+    return profit_details, update_time
+
+
+def get_craftable_categories() -> dict[str, str]:
+    # category id -> pretty name, in the order of the items file
+    return _craftable_categories
+
+
+def create_calculation_key(limitations: str, recipe_type: str, use_focus: bool) -> str:
+    use_focus_str = 'WITH_FOCUS' if use_focus else 'NO_FOCUS'
+    return f'{recipe_type}_{limitations}_{use_focus_str}'
+
+
+def _load_craftable_categories() -> dict[str, str]:
+    # the list depends only on the game data files, it's computed once and reused until one of them changes
+    sources_stamp = _get_sources_stamp()
+    try:
+        with open(_CATEGORIES_FILE) as f:
+            cached = json.load(f)
+        if cached['sources_stamp'] == sources_stamp:
+            return cached['categories']
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    logging.info('Craftable categories not computed for current game data, parsing items file')
+    from albion_calculator_backend import shop_categories
+    categories = {category: shop_categories.get_category_pretty_name(category)
+                  for category in shop_categories.get_craftable_shop_categories()}
+    _save_craftable_categories(categories, sources_stamp)
+    return categories
+
+
+def _get_sources_stamp() -> list[list[int]]:
+    stamps = []
+    for path in (ITEMS_JSON_FILE, _CRAFTINGMODIFIERS_FILE):
+        stat = path.stat()
+        stamps.append([stat.st_mtime_ns, stat.st_size])
+    return stamps
+
+
+def _save_craftable_categories(categories: dict[str, str], sources_stamp: list[list[int]]) -> None:
+    # only saves parsing on the next start, a read-only or full disk mustn't stop the web app from starting
+    temporary_file = _CATEGORIES_FILE.with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        os.makedirs(_CATEGORIES_FILE.parent, exist_ok=True)
+        with open(temporary_file, 'w') as f:
+            json.dump({'sources_stamp': sources_stamp, 'categories': categories}, f, indent=1)
+        os.replace(temporary_file, _CATEGORIES_FILE)
+    except OSError as e:
+        logging.warning(f'Craftable categories could not be saved to {_CATEGORIES_FILE}: {e}')
+        temporary_file.unlink(missing_ok=True)
+
+
+_craftable_categories = _load_craftable_categories()
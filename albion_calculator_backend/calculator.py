@@ -1,302 +1,593 @@
-import datetime
+import functools
+import heapq
 import logging
-from math import nan
-from time import sleep
-from typing import Optional
+import threading
+from collections import defaultdict
+from math import nan, inf
+from typing import Optional, NamedTuple
 
 import numpy as np
-from apscheduler.schedulers.background import BackgroundScheduler
 from numpy import ndarray
-from sqlalchemy.orm import Query
 
 import albion_calculator_backend.items
-import albion_calculator_web.database
-from albion_calculator_backend import items, cities, journals, market, crafting_modifiers, shop_categories, config
+from albion_calculator_backend import items, cities, journals, market, crafting_modifiers, config, metrics, \
+    profiling, recipe_dependencies, routing, crafting_chain, item_metadata, fees, calculations_export
+from albion_calculator_backend.calculations_reader import ONE_TILE, create_calculation_key
+from albion_calculator_backend.crafting_chain import ChainCosts
 from albion_calculator_backend.database import BackendSession
-from albion_calculator_backend.database_models import ProfitDetails, IngredientDetails, CalculationsUpdate
 from albion_calculator_backend.market import get_prices_for_item, get_price_for_item_in_city
-from albion_calculator_backend.models import RecipeType, Ingredient, Recipe
+from albion_calculator_backend.models import RecipeType, Ingredient, Recipe, ProfitDetailsRecord, \
+    IngredientDetailsRecord, CalculationsUpdateRecord
 
 _PROFIT_LIMIT = config.CONFIG['APP']['CALCULATOR']['PROFIT_PERCENTAGE_LIMIT']
 
-ONE_TILE = config.CONFIG['APP']['CALCULATOR']['TRAVEL_COST_ONE_TILE']
-
-TWO_TILES = ONE_TILE ** 2
-
-
-def _one_city_multipliers() -> list[ndarray]:
-    arrays = []
-    for i in range(6):
-        array = np.empty((6, 6))
-        array[:] = nan
-        array[i][i] = 1
-        arrays.append(array)
-    return arrays
-
-
-# MATRIX[transport_to][transport_from]
-_MULTIPLIERS = {
-    'TRAVEL': np.array([
-        [1.0, ONE_TILE, TWO_TILES, TWO_TILES, ONE_TILE, ONE_TILE],
-        [ONE_TILE, 1.0, ONE_TILE, TWO_TILES, TWO_TILES, ONE_TILE],
-        [TWO_TILES, ONE_TILE, 1.0, ONE_TILE, TWO_TILES, ONE_TILE],
-        [TWO_TILES, TWO_TILES, ONE_TILE, 1.0, ONE_TILE, ONE_TILE],
-        [ONE_TILE, TWO_TILES, TWO_TILES, ONE_TILE, 1.0, ONE_TILE],
-        [ONE_TILE, ONE_TILE, ONE_TILE, ONE_TILE, ONE_TILE, 1.0]
-    ]),
-    'NO_RISK': np.array([
-        [1.0, ONE_TILE, TWO_TILES, TWO_TILES, ONE_TILE, nan],
-        [ONE_TILE, 1.0, ONE_TILE, TWO_TILES, TWO_TILES, nan],
-        [TWO_TILES, ONE_TILE, 1.0, ONE_TILE, TWO_TILES, nan],
-        [TWO_TILES, TWO_TILES, ONE_TILE, 1.0, ONE_TILE, nan],
-        [ONE_TILE, TWO_TILES, TWO_TILES, ONE_TILE, 1.0, nan],
-        [nan, nan, nan, nan, nan, 1.0]
-    ]),
-    'NO_TRAVEL': np.array([
-        [1.0, nan, nan, nan, nan, nan],
-        [nan, 1.0, nan, nan, nan, nan],
-        [nan, nan, 1.0, nan, nan, nan],
-        [nan, nan, nan, 1.0, nan, nan],
-        [nan, nan, nan, nan, 1.0, nan],
-        [nan, nan, nan, nan, nan, 1.0]
-    ]),
-    'PER_CITY': _one_city_multipliers(),
-}
-
-
-def get_calculations(recipe_type: str, limitation: str, city_index: int, use_focus: bool,
-                     category: str) -> tuple[Query, datetime]:
-    key = _create_calculation_key(limitation, recipe_type, use_focus)
-    key = key if not limitation == 'PER_CITY' else f'{key} + {cities.city_at_index(city_index).upper().replace(" ", "_")}'
-    profit_details, update_time = albion_calculator_web.database.find_calculations_for_key_and_category(key, category)
-    return profit_details, update_time
-
-
-def _calculate_profit_details_for_recipe(recipe: Recipe, multiplier: ndarray,
-                                         use_focus: bool) -> Optional[ProfitDetails]:
-    missing_ingredients = _check_missing_ingredients_prices(recipe, multiplier)
-    if missing_ingredients:
-        return None
-    ingredients_best_deals = _calculate_ingredients_best_deals(multiplier, recipe, use_focus)
+_DELTA_RECALCULATION = config.CONFIG['APP']['CALCULATOR'].get('DELTA_RECALCULATION', False)
+
+_CUSTOM_CALCULATIONS_CACHE_SIZE = config.CONFIG['APP']['CALCULATOR'].get('CUSTOM_CALCULATIONS_CACHE_SIZE', 32)
+
+_CRAFTING_CHAIN = config.CONFIG['APP']['CALCULATOR'].get('CRAFTING_CHAIN', False)
+
+_TOP_K = config.CONFIG['APP']['CALCULATOR'].get('TOP_K', None)
+
+# PROFIT_PERCENTAGE or DAILY_PROFIT - profit of selling as many products as were sold in the last 24h
+_RANKING = config.CONFIG['APP']['CALCULATOR'].get('RANKING', 'PROFIT_PERCENTAGE')
+
+_MULTIPLIERS = routing.get_multipliers(ONE_TILE, market.PRICE_DTYPE)
+
+_RECIPES_BY_TYPE = {'CRAFTING': items.get_all_crafting_recipes,
+                    'CHAIN': items.get_all_crafting_recipes,
+                    'UPGRADE': items.get_all_upgrade_recipes,
+                    'TRANSPORT': items.get_all_transport_recipes}
+
+# set when the worker is shutting down, running calculations stop before the next calculation key
+_stop_requested = threading.Event()
+
+_NO_JOURNAL_PROFIT = {'journals_profit': 0, 'profit_per_journal': 0, 'journals_filled': 0}
+
+# (price generation, profit of a single journal for every item), see _get_journal_profits_per_item
+_journal_profits = (None, None)
+
+# (price generation, id of multiplier -> item_id -> best deals), see _get_best_deals_memo
+_best_deals_memo = (None, {})
+
+_best_deals_memo_stats = {'hits': 0, 'misses': 0}
+
+# type_key -> (ranked results of the latest calculation keyed by id of the recipe, scores of all calculated recipes),
+# used for delta recalculation
+_latest_results = {}
+
+
+class CalculationsInterrupted(Exception):
+    pass
+
+
+class _UnitBestDeals(NamedTuple):
+    # for every production city: price of a single unit in the cheapest source city, transport multiplier from it
+    # and the source city; missing when it can't be bought anywhere
+    prices: ndarray
+    multipliers: ndarray
+    sources: ndarray
+    missing: bool
+
+
+class _ProfitEvaluation(NamedTuple):
+    # everything needed to rank a recipe, details are created only for the ones which are kept
+    recipe: Recipe
+    max_profit: float
+    destination_city_index: int
+    production_city_index: int
+    ingredients_costs: dict[str, tuple[ndarray, ndarray]]
+    journal_profit_details: dict[str, float]
+    ingredients_total_cost: int
+    profit_percentage: float
+    sellable_volume: float
+    daily_profit: float
+
+
+def calculate_custom_profits(recipe_type: str, limitation: str, travel_cost: float, allowed_cities: list[int],
+                             use_focus: bool, category: str,
+                             full_output: bool = False) -> tuple[ProfitDetailsRecord, ...]:
+    recipe_type, limitation, category = recipe_type.upper(), limitation.upper(), category.lower()
+    if recipe_type not in _RECIPES_BY_TYPE:
+        raise ValueError(f'Unknown recipe type {recipe_type}')
+    if limitation not in ('TRAVEL', 'NO_RISK', 'NO_TRAVEL'):
+        raise ValueError(f'Unsupported limitation {limitation}')
+    if not 1 <= travel_cost <= 10:
+        raise ValueError(f'Travel cost {travel_cost} out of range')
+    cities_count = cities.cities_count()
+    allowed_cities = tuple(sorted(set(allowed_cities))) if allowed_cities else tuple(range(cities_count))
+    if not all(0 <= city_index < cities_count for city_index in allowed_cities):
+        raise ValueError(f'Unknown city in {allowed_cities}')
+    use_focus = use_focus and recipe_type in ('CRAFTING', 'CHAIN')
+    return _calculate_custom_profits(recipe_type, limitation, round(travel_cost, 4), allowed_cities, use_focus,
+                                     category, full_output, market.get_price_generation())
+
+
+@functools.lru_cache(maxsize=_CUSTOM_CALCULATIONS_CACHE_SIZE)
+def _calculate_custom_profits(recipe_type: str, limitation: str, travel_cost: float, allowed_cities: tuple[int],
+                              use_focus: bool, category: str, full_output: bool,
+                              price_generation: int) -> tuple[ProfitDetailsRecord, ...]:
+    # price_generation is a part of the cache key only, results for outdated prices are never hit again
+    multiplier = _restrict_to_cities(routing.get_multipliers(travel_cost, market.PRICE_DTYPE)[limitation],
+                                     allowed_cities)
+    recipes = [recipe for recipe in _RECIPES_BY_TYPE[recipe_type]()
+               if category == 'all' or items.get_item_subcategory(recipe.result_item_id) == category]
+    with metrics.span('calculate_custom_profits', key=create_calculation_key(limitation, recipe_type, use_focus)):
+        chain_costs = crafting_chain.calculate_chain_costs(multiplier, use_focus) if recipe_type == 'CHAIN' else None
+        top_k = None if full_output else _TOP_K
+        return tuple(_calculate_profits_for_recipes(recipes, multiplier, use_focus, chain_costs, top_k).values())
+
+
+def _restrict_to_cities(multiplier: ndarray, allowed_cities: tuple[int]) -> ndarray:
+    restricted = np.full(multiplier.shape, nan, dtype=multiplier.dtype)
+    restricted[np.ix_(allowed_cities, allowed_cities)] = multiplier[np.ix_(allowed_cities, allowed_cities)]
+    return restricted
+
+
+def _evaluate_recipe(recipe: Recipe, multiplier: ndarray, use_focus: bool,
+                     chain_costs: Optional[ChainCosts] = None) -> Optional[_ProfitEvaluation]:
+    memo = _get_best_deals_memo(multiplier, chain_costs)
+    if memo is not None:
+        ingredients_best_deals = _calculate_memoized_ingredients_best_deals(multiplier, recipe, use_focus, memo)
+        if ingredients_best_deals is None:
+            return None
+    else:
+        missing_ingredients = _check_missing_ingredients_prices(recipe, multiplier, chain_costs)
+        if missing_ingredients:
+            return None
+        ingredients_best_deals = _calculate_ingredients_best_deals(multiplier, recipe, use_focus, chain_costs)
 
     final_profit_matrix = _calculate_final_profit_matrix(ingredients_best_deals, multiplier, recipe)
     if np.isnan(final_profit_matrix).all():
         return None
 
     journal_profit_details = _calculate_journal_profit(recipe)
-    profit_details = _summarize_profit(final_profit_matrix, ingredients_best_deals, journal_profit_details, multiplier,
-                                       recipe)
-    return profit_details
-
-
-def _check_missing_ingredients_prices(recipe: Recipe, multiplier: ndarray) -> list[str]:
+    sales_volumes = market.get_sales_volumes_for_item(recipe.result_item_id)
+    # crafts which can be sold in a day in every destination city
+    crafts_sold_daily = sales_volumes / recipe.result_quantity
+    ranking_matrix = final_profit_matrix if _RANKING != 'DAILY_PROFIT' else \
+        (final_profit_matrix + journal_profit_details['journals_profit']) * crafts_sold_daily[:, np.newaxis]
+    destination_city_index, production_city_index = np.unravel_index(np.nanargmax(ranking_matrix),
+                                                                     ranking_matrix.shape)
+    max_profit = float(final_profit_matrix[destination_city_index, production_city_index])
+    final_profit = max_profit + journal_profit_details['journals_profit']
+    ingredients_total_cost = sum(int(ingredients_best_deals[ingredient.item_id][0][production_city_index])
+                                 for ingredient in recipe.ingredients)
+    return _ProfitEvaluation(recipe=recipe,
+                             max_profit=max_profit,
+                             destination_city_index=destination_city_index,
+                             production_city_index=production_city_index,
+                             ingredients_costs=ingredients_best_deals,
+                             journal_profit_details=journal_profit_details,
+                             ingredients_total_cost=ingredients_total_cost,
+                             profit_percentage=round(final_profit / ingredients_total_cost * 100, 2),
+                             sellable_volume=float(sales_volumes[destination_city_index]),
+                             daily_profit=round(final_profit * float(crafts_sold_daily[destination_city_index]), 2))
+
+
+def _get_ingredient_prices(item_id: str, chain_costs: Optional[ChainCosts]) -> ndarray:
+    # with chain costs ingredients are valued at the cheaper of buying and producing them
+    return get_prices_for_item(item_id) if chain_costs is None else chain_costs.costs[item_id]
+
+
+def _check_missing_ingredients_prices(recipe: Recipe, multiplier: ndarray,
+                                      chain_costs: Optional[ChainCosts] = None) -> list[str]:
     return [ingredient.item_id for ingredient in recipe.ingredients
-            if np.isnan(market.get_prices_for_item(ingredient.item_id) * multiplier).all()]
+            if np.isnan(_get_ingredient_prices(ingredient.item_id, chain_costs) * multiplier).all()]
 
 
-def _summarize_profit(final_profit_matrix: ndarray, ingredients_costs: list[dict[str, tuple]],
-                      journal_profit_details: dict[str, float], multiplier: ndarray, recipe: Recipe) -> ProfitDetails:
-    max_profit = float(np.nanmax(final_profit_matrix))
+def _summarize_profit(evaluation: _ProfitEvaluation, multiplier: ndarray,
+                      chain_costs: Optional[ChainCosts] = None) -> ProfitDetailsRecord:
+    recipe, max_profit, journal_profit_details = evaluation.recipe, evaluation.max_profit, \
+        evaluation.journal_profit_details
+    destination_city_index, production_city_index = evaluation.destination_city_index, \
+        evaluation.production_city_index
     final_profit = max_profit + journal_profit_details['journals_profit']
-    destination_city_index, production_city_index = np.unravel_index(np.nanargmax(final_profit_matrix),
-                                                                     final_profit_matrix.shape)
-    ingredients_details = _summarize_ingredient_details(ingredients_costs, multiplier, production_city_index, recipe)
+    ingredients_details = _summarize_ingredient_details(evaluation.ingredients_costs, multiplier,
+                                                        production_city_index, recipe, chain_costs)
     final_product_price = get_price_for_item_in_city(recipe.result_item_id, destination_city_index)
-    ingredients_total_cost = sum(ingredient.total_cost_with_returns for ingredient in ingredients_details)
+    metadata, product_index = item_metadata.get_metadata_table(), item_metadata.get_item_index(recipe.result_item_id)
 
-    return ProfitDetails(
+    return ProfitDetailsRecord(
         product_id=recipe.result_item_id,
-        product_name=items.get_item_name(recipe.result_item_id),
-        product_subcategory=shop_categories.get_category_pretty_name(items.get_item_subcategory(recipe.result_item_id)),
-        product_subcategory_id=items.get_item_subcategory(recipe.result_item_id),
-        product_tier=items.get_item_tier(recipe.result_item_id),
+        product_name=metadata.names[product_index],
+        product_subcategory=metadata.subcategories_names[product_index],
+        product_subcategory_id=metadata.subcategories_ids[product_index],
+        product_tier=metadata.tiers[product_index],
         product_quantity=recipe.result_quantity,
         recipe_type=recipe.recipe_type,
         final_product_price=int(final_product_price),
-        ingredients_total_cost=ingredients_total_cost,
+        ingredients_total_cost=evaluation.ingredients_total_cost,
         profit_without_journals=int(max_profit),
         profit_per_journal=round(journal_profit_details['profit_per_journal'], 2),
         journals_filled=round(journal_profit_details['journals_filled'], 2),
         profit_with_journals=int(final_profit),
-        profit_percentage=round(final_profit / ingredients_total_cost * 100, 2),
+        profit_percentage=evaluation.profit_percentage,
+        sellable_volume=evaluation.sellable_volume,
+        daily_profit=evaluation.daily_profit,
         destination_city=cities.city_at_index(destination_city_index),
         production_city=cities.city_at_index(production_city_index),
         ingredients_details=ingredients_details
     )
 
 
-def _summarize_ingredient_details(ingredients_costs: list[dict[str, tuple]], multiplier: ndarray,
-                                  production_city_index: int, recipe: Recipe) -> list[IngredientDetails]:
+def _summarize_ingredient_details(ingredients_costs: dict[str, tuple[ndarray, ndarray]], multiplier: ndarray,
+                                  production_city_index: int, recipe: Recipe,
+                                  chain_costs: Optional[ChainCosts] = None) -> list[IngredientDetailsRecord]:
     ingredients_details = []
+    names = item_metadata.get_metadata_table().names
     for ingredient in recipe.ingredients:
         item_id = ingredient.item_id
-        price_with_returns, import_from = ingredients_costs[production_city_index][item_id]
+        costs, sources = ingredients_costs[item_id]
+        price_with_returns, import_from = costs[production_city_index], sources[production_city_index]
         quantity = ingredient.quantity
-        local_price = get_price_for_item_in_city(item_id, import_from)
+        local_price = _get_ingredient_prices(item_id, chain_costs)[import_from]
         total_cost = quantity * local_price
         total_cost_with_transport = total_cost * multiplier[import_from][production_city_index]
-        ingredients_details.append(IngredientDetails(
-            item_name=items.get_item_name(item_id),
+        ingredients_details.append(IngredientDetailsRecord(
+            item_name=names[item_metadata.get_item_index(item_id)],
             item_id=item_id,
             local_price=int(local_price),
             total_cost=int(total_cost),
             total_cost_with_transport=int(total_cost_with_transport),
             total_cost_with_returns=int(price_with_returns),
-            source_city=cities.city_at_index(import_from),
+            source_city=_describe_source_city(item_id, import_from, chain_costs),
             quantity=quantity
         ))
     return ingredients_details
 
 
+def _describe_source_city(item_id: str, city_index: int, chain_costs: Optional[ChainCosts]) -> str:
+    if chain_costs is None:
+        return cities.city_at_index(city_index)
+    source_city = cities.city_at_index(chain_costs.origins[item_id][city_index])
+    return f'{source_city} (crafted)' if chain_costs.is_produced(item_id, city_index) else source_city
+
+
 def _calculate_journal_profit(recipe: Recipe) -> dict[str, float]:
-    no_journal_profit = {'journals_profit': 0, 'profit_per_journal': 0, 'journals_filled': 0}
     if not recipe.recipe_type == RecipeType.CRAFTING:
-        return no_journal_profit
-    item_id = recipe.result_item_id
-    journal = journals.get_journal_for_item(item_id)
-    if journal is None:
-        return no_journal_profit
-    crafting_fame = items.get_item_crafting_fame(item_id)
-    full_journal_price = market.get_avg_price_for_item(journal['item_id'] + '_FULL')
-    empty_journal_price = journal['cost']
-    if np.isnan(full_journal_price) or empty_journal_price == 0:
-        return no_journal_profit
-    profit_per_journal = full_journal_price - empty_journal_price
-    journals_filled = crafting_fame / journal['max_fame']
-    return {'journals_profit': profit_per_journal * journals_filled,
-            'profit_per_journal': profit_per_journal,
+        return _NO_JOURNAL_PROFIT
+    item_index = item_metadata.get_item_index(recipe.result_item_id)
+    profit_per_journal = _get_journal_profits_per_item()[item_index]
+    if np.isnan(profit_per_journal):
+        return _NO_JOURNAL_PROFIT
+    journals_filled = float(journals.get_journal_table().journals_filled[item_index])
+    return {'journals_profit': float(profit_per_journal) * journals_filled,
+            'profit_per_journal': float(profit_per_journal),
             'journals_filled': journals_filled}
 
 
-def _find_ingredients_best_deals_per_city(ingredients_price_matrices: dict[str, ndarray]) -> list[dict[str, tuple]]:
-    return [{item_id: _find_ingredient_best_deal_for_city(city, price_matrix)
-             for item_id, price_matrix in ingredients_price_matrices.items()}
-            for city in range(6)]
+def _get_journal_profits_per_item() -> ndarray:
+    # depends on prices only, calculated once per prices update and shared by all calculation variants
+    global _journal_profits
+    price_generation = market.get_price_generation()
+    calculated_generation, profits = _journal_profits
+    if calculated_generation != price_generation:
+        profits = _calculate_journal_profits_per_item(journals.get_journal_table())
+        _journal_profits = (price_generation, profits)
+    return profits
 
 
-def _find_ingredient_best_deal_for_city(city_index: int, price_matrix: ndarray) -> tuple:
-    if np.isnan(price_matrix[city_index]).all():
-        return nan, nan
-    index = np.nanargmin(price_matrix[city_index])
-    return price_matrix[city_index][index], index
+def _calculate_journal_profits_per_item(journal_table: journals.JournalTable) -> ndarray:
+    # profit of filling a single journal for every item, nan if the item has no journal or it has no price
+    full_journals_prices = np.array([market.get_avg_price_for_item(journal_id + '_FULL')
+                                     for journal_id in journal_table.journals_ids], dtype=float)
+    profits = np.where(journal_table.costs == 0, nan, full_journals_prices - journal_table.costs)
+    # NO_JOURNAL (-1) picks the nan appended at the end
+    return np.append(profits, nan)[journal_table.journal_indexes]
 
 
-def _calculate_final_profit_matrix(ingredients_costs: list[dict[str, tuple]], multiplier: ndarray,
-                                   recipe: Recipe) -> ndarray:
-    ingredients_costs_total = [sum(item[0] for item in city.values()) for city in ingredients_costs]
-    product_price = get_prices_for_item(recipe.result_item_id)
-    return (product_price * recipe.result_quantity / multiplier).T - ingredients_costs_total
+def _find_ingredient_best_deals(price_matrix: ndarray) -> tuple[ndarray, ndarray]:
+    # cheapest cost and source city for every production city at once, nan cost if it can't be bought anywhere
+    missing_prices = np.isnan(price_matrix)
+    sources = np.where(missing_prices, inf, price_matrix).argmin(axis=1)
+    costs = price_matrix[np.arange(len(price_matrix)), sources]
+    costs[missing_prices.all(axis=1)] = nan
+    return costs, sources
 
 
-def _calculate_ingredients_best_deals(multiplier: ndarray, recipe: Recipe,
-                                      use_focus: bool) -> list[dict[str, tuple]]:
-    return_rates = crafting_modifiers.get_return_rates_vector(recipe.result_item_id, use_focus)
-    ingredients_price_matrices = {
-        ingredient.item_id: _calculate_single_ingredient_cost(ingredient, multiplier, recipe.recipe_type,
-                                                              return_rates)
+def _calculate_final_profit_matrix(ingredients_costs: dict[str, tuple[ndarray, ndarray]], multiplier: ndarray,
+                                   recipe: Recipe) -> ndarray:
+    # rows are destination cities and columns production cities, fees and taxes are vectors over them
+    production_costs = fees.add_production_fees(sum(costs for costs, _ in ingredients_costs.values()), recipe)
+    product_price = get_prices_for_item(recipe.result_item_id) * fees.SALE_FACTORS
+    return (product_price * recipe.result_quantity / multiplier).T - production_costs
+
+
+def _calculate_ingredients_best_deals(multiplier: ndarray, recipe: Recipe, use_focus: bool,
+                                      chain_costs: Optional[ChainCosts] = None) -> dict[str, tuple[ndarray, ndarray]]:
+    return_rates = crafting_modifiers.get_return_rates_vector(recipe.result_item_id, use_focus,
+                                                              market.PRICE_DTYPE)
+    return {ingredient.item_id: _find_ingredient_best_deals(
+        _calculate_single_ingredient_cost(ingredient, multiplier, recipe.recipe_type, return_rates,
+                                          _get_ingredient_prices(ingredient.item_id, chain_costs)))
         for ingredient in recipe.ingredients}
-    ingredients_best_deals = _find_ingredients_best_deals_per_city(ingredients_price_matrices)
-    return ingredients_best_deals
+
+
+def _calculate_memoized_ingredients_best_deals(multiplier: ndarray, recipe: Recipe, use_focus: bool,
+                                               memo: dict[str, _UnitBestDeals]
+                                               ) -> Optional[dict[str, tuple[ndarray, ndarray]]]:
+    # same as _calculate_ingredients_best_deals, None if any ingredient can't be bought anywhere
+    units_best_deals = {ingredient.item_id: _find_unit_best_deals(ingredient.item_id, multiplier, memo)
+                        for ingredient in recipe.ingredients}
+    if any(unit_best_deals.missing for unit_best_deals in units_best_deals.values()):
+        return None
+    return_rates = crafting_modifiers.get_return_rates_vector(recipe.result_item_id, use_focus,
+                                                              market.PRICE_DTYPE)
+    return {ingredient.item_id: _scale_unit_best_deals(ingredient, recipe.recipe_type, return_rates,
+                                                       units_best_deals[ingredient.item_id])
+            for ingredient in recipe.ingredients}
 
 
 def _calculate_single_ingredient_cost(ingredient: Ingredient, multiplier: ndarray, recipe_type: str,
-                                      return_rates: ndarray) -> ndarray:
-    price_matrix = get_prices_for_item(ingredient.item_id) * ingredient.quantity * multiplier
+                                      return_rates: ndarray, ingredient_prices: ndarray) -> ndarray:
+    price_matrix = ingredient_prices * ingredient.quantity * multiplier
     if recipe_type == RecipeType.CRAFTING and ingredient.max_return_rate != 0:
         price_matrix = price_matrix * return_rates
     return price_matrix
 
 
-def update_calculations() -> None:
-    market.update_prices()
-    with BackendSession() as session:
-        _update_transport_calculations(session)
-        if not config.CONFIG['APP']['CALCULATOR'].get('TESTING', False):
-            _update_crafting_calculations(session)
-            _update_upgrade_calculations(session)
+def _scale_unit_best_deals(ingredient: Ingredient, recipe_type: str, return_rates: ndarray,
+                           unit_best_deals: _UnitBestDeals) -> tuple[ndarray, ndarray]:
+    # quantity and return rate are the same for all source cities, so they don't change where it's cheapest;
+    # the order of multiplication is the one of _calculate_single_ingredient_cost
+    costs = unit_best_deals.prices * ingredient.quantity * unit_best_deals.multipliers
+    if recipe_type == RecipeType.CRAFTING and ingredient.max_return_rate != 0:
+        costs = costs * return_rates[:, 0]
+    return costs, unit_best_deals.sources
+
+
+def _find_unit_best_deals(item_id: str, multiplier: ndarray, memo: dict[str, _UnitBestDeals]) -> _UnitBestDeals:
+    unit_best_deals = memo.get(item_id, None)
+    if unit_best_deals is not None:
+        _best_deals_memo_stats['hits'] += 1
+        return unit_best_deals
+    _best_deals_memo_stats['misses'] += 1
+    prices = get_prices_for_item(item_id)
+    price_matrix = prices * multiplier
+    _, sources = _find_ingredient_best_deals(price_matrix)
+    unit_best_deals = _UnitBestDeals(prices=prices[sources], multipliers=multiplier[np.arange(len(sources)), sources],
+                                     sources=sources, missing=bool(np.isnan(price_matrix).all()))
+    memo[item_id] = unit_best_deals
+    return unit_best_deals
+
+
+def _get_best_deals_memo(multiplier: ndarray, chain_costs: Optional[ChainCosts]) -> Optional[dict[str, _UnitBestDeals]]:
+    # best deals of an ingredient depend only on its prices and the multiplier, all recipes and variants using
+    # the same multiplier share them until prices change
+    global _best_deals_memo
+    if chain_costs is not None or multiplier.flags.writeable:
+        # chain costs already include transport, buying locally and importing tie and the order of multiplication
+        # decides between them; only shared multipliers are read-only, ids of temporary ones can be reused
+        return None
+    price_generation = market.get_price_generation()
+    if _best_deals_memo[0] != price_generation:
+        _best_deals_memo = (price_generation, {})
+    return _best_deals_memo[1].setdefault(id(multiplier), {})
+
+
+def _reset_best_deals_memo_stats() -> None:
+    _best_deals_memo_stats.update(hits=0, misses=0)
+
+
+def _report_best_deals_memo_stats() -> None:
+    hits, misses = _best_deals_memo_stats['hits'], _best_deals_memo_stats['misses']
+    metrics.increment('ingredient_best_deals_memo', hits, result='hit')
+    metrics.increment('ingredient_best_deals_memo', misses, result='miss')
+    if hits + misses:
+        metrics.observe('ingredient_best_deals_memo_hit_rate', hits / (hits + misses))
+        logging.info(f'Ingredient best deals memo: {hits} hits, {misses} misses ({hits / (hits + misses):.1%})')
+
+
+def request_stop() -> None:
+    _stop_requested.set()
+
+
+def update_calculations(full_recalculation: bool = False) -> None:
+    _reset_best_deals_memo_stats()
+    with metrics.span('update_calculations'), profiling.profile('update_calculations'):
+        with metrics.span('update_prices'):
+            market.update_prices(publish=True)
+        _check_stop_requested()
+        changed_items, affected_recipes = None, None
+        if _DELTA_RECALCULATION and not full_recalculation and _latest_results:
+            changed_items, affected_recipes = recipe_dependencies.find_affected_recipes()
+            metrics.increment('recipes_affected_by_price_changes', len(affected_recipes))
+        with calculations_export.generation(market.get_price_generation()), BackendSession() as session:
+            _update_transport_calculations(session, affected_recipes)
+            if not config.CONFIG['APP']['CALCULATOR'].get('TESTING', False):
+                _update_crafting_calculations(session, affected_recipes)
+                _update_upgrade_calculations(session, affected_recipes)
+                if _CRAFTING_CHAIN:
+                    _update_chain_calculations(session)
+        if _DELTA_RECALCULATION:
+            recipe_dependencies.remember_calculated_prices(changed_items)
+    _report_best_deals_memo_stats()
+    metrics.publish()
     logging.info('Everything calculated and saved to DB')
 
 
-def _update_upgrade_calculations(session: BackendSession) -> None:
+def _update_upgrade_calculations(session: BackendSession, affected_recipes: Optional[list[Recipe]] = None) -> None:
     recipes = albion_calculator_backend.items.get_all_upgrade_recipes()
-    _save_calculations(session, _calculate_profits('UPGRADE', 'PER_CITY', recipes, use_focus=False))
-    _save_calculations(session, _calculate_profits('UPGRADE', 'NO_TRAVEL', recipes, use_focus=False))
-    _save_calculations(session, _calculate_profits('UPGRADE', 'TRAVEL', recipes, use_focus=False))
-    _save_calculations(session, _calculate_profits('UPGRADE', 'NO_RISK', recipes, use_focus=False))
+    affected = _filter_recipes_of_type(affected_recipes, RecipeType.UPGRADE)
+    _save_calculations(session, _calculate_profits('UPGRADE', 'PER_CITY', recipes, False, affected))
+    _save_calculations(session, _calculate_profits('UPGRADE', 'NO_TRAVEL', recipes, False, affected))
+    _save_calculations(session, _calculate_profits('UPGRADE', 'TRAVEL', recipes, False, affected))
+    _save_calculations(session, _calculate_profits('UPGRADE', 'NO_RISK', recipes, False, affected))
 
 
-def _update_transport_calculations(session: BackendSession) -> None:
+def _update_transport_calculations(session: BackendSession, affected_recipes: Optional[list[Recipe]] = None) -> None:
     recipes = albion_calculator_backend.items.get_all_transport_recipes()
-    _save_calculations(session, _calculate_profits('TRANSPORT', 'TRAVEL', recipes, use_focus=False))
-    _save_calculations(session, _calculate_profits('TRANSPORT', 'NO_RISK', recipes, use_focus=False))
+    affected = _filter_recipes_of_type(affected_recipes, RecipeType.TRANSPORT)
+    _save_calculations(session, _calculate_profits('TRANSPORT', 'TRAVEL', recipes, False, affected))
+    _save_calculations(session, _calculate_profits('TRANSPORT', 'NO_RISK', recipes, False, affected))
 
 
-def _update_crafting_calculations(session: BackendSession) -> None:
+def _update_crafting_calculations(session: BackendSession, affected_recipes: Optional[list[Recipe]] = None) -> None:
     recipes = albion_calculator_backend.items.get_all_crafting_recipes()
-    _save_calculations(session, _calculate_profits('CRAFTING', 'PER_CITY', recipes, use_focus=True))
-    _save_calculations(session, _calculate_profits('CRAFTING', 'PER_CITY', recipes, use_focus=False))
-    _save_calculations(session, _calculate_profits('CRAFTING', 'NO_TRAVEL', recipes, use_focus=True))
-    _save_calculations(session, _calculate_profits('CRAFTING', 'NO_TRAVEL', recipes, use_focus=False))
-    _save_calculations(session, _calculate_profits('CRAFTING', 'TRAVEL', recipes, use_focus=True))
-    _save_calculations(session, _calculate_profits('CRAFTING', 'TRAVEL', recipes, use_focus=False))
-    _save_calculations(session, _calculate_profits('CRAFTING', 'NO_RISK', recipes, use_focus=True))
-    _save_calculations(session, _calculate_profits('CRAFTING', 'NO_RISK', recipes, use_focus=False))
-
-
-def _save_calculations(session: BackendSession, calculations_updates: list[CalculationsUpdate]):
-    for calculation_update in calculations_updates:
-        session.bulk_insert_calculations_update(calculation_update)
-        session.delete_previous_calculation_updates(calculation_update.type_key)
-
-
-def _calculate_profits(recipe_type: str, limitations: str, recipes: list[Recipe], use_focus: bool) -> \
-        list[CalculationsUpdate]:
-    type_key = _create_calculation_key(limitations, recipe_type, use_focus)
-    if limitations == 'PER_CITY':
-        result = [CalculationsUpdate(type_key=key, profit_details=profit_details)
-                  for key, profit_details in _calculate_profits_per_city(recipes, use_focus, type_key).items()]
-    else:
-        result = [CalculationsUpdate(type_key=type_key,
-                                     profit_details=_calculate_profits_for_recipes(recipes,
-                                                                                   _MULTIPLIERS[limitations],
-                                                                                   use_focus))]
-    logging.debug(f'{type_key} loaded')
-    return result
+    affected = _filter_recipes_of_type(affected_recipes, RecipeType.CRAFTING)
+    _save_calculations(session, _calculate_profits('CRAFTING', 'PER_CITY', recipes, True, affected))
+    _save_calculations(session, _calculate_profits('CRAFTING', 'PER_CITY', recipes, False, affected))
+    _save_calculations(session, _calculate_profits('CRAFTING', 'NO_TRAVEL', recipes, True, affected))
+    _save_calculations(session, _calculate_profits('CRAFTING', 'NO_TRAVEL', recipes, False, affected))
+    _save_calculations(session, _calculate_profits('CRAFTING', 'TRAVEL', recipes, True, affected))
+    _save_calculations(session, _calculate_profits('CRAFTING', 'TRAVEL', recipes, False, affected))
+    _save_calculations(session, _calculate_profits('CRAFTING', 'NO_RISK', recipes, True, affected))
+    _save_calculations(session, _calculate_profits('CRAFTING', 'NO_RISK', recipes, False, affected))
+
+
+def _update_chain_calculations(session: BackendSession) -> None:
+    # best costs depend on whole chains of ingredients, so these are always recalculated in full
+    recipes = albion_calculator_backend.items.get_all_crafting_recipes()
+    _save_calculations(session, _calculate_profits('CHAIN', 'NO_TRAVEL', recipes, True))
+    _save_calculations(session, _calculate_profits('CHAIN', 'NO_TRAVEL', recipes, False))
+    _save_calculations(session, _calculate_profits('CHAIN', 'TRAVEL', recipes, True))
+    _save_calculations(session, _calculate_profits('CHAIN', 'TRAVEL', recipes, False))
+    _save_calculations(session, _calculate_profits('CHAIN', 'NO_RISK', recipes, True))
+    _save_calculations(session, _calculate_profits('CHAIN', 'NO_RISK', recipes, False))
 
 
-def _calculate_profits_per_city(recipes: list[Recipe], use_focus: bool, type_key: str) -> \
-        dict[str, list[ProfitDetails]]:
-    return {f'{type_key}_{city_name.upper().replace(" ", "_")}': _calculate_profits_for_recipes(recipes, multiplier,
-                                                                                                use_focus)
-            for city_name, multiplier in zip(cities.cities_names(), _MULTIPLIERS['PER_CITY'])}
+def _filter_recipes_of_type(recipes: Optional[list[Recipe]], recipe_type: RecipeType) -> Optional[list[Recipe]]:
+    if recipes is None:
+        return None
+    return [recipe for recipe in recipes if recipe.recipe_type == recipe_type]
 
 
-def _calculate_profits_for_recipes(recipes: list[Recipe], multiplier: ndarray, use_focus: bool) -> list[ProfitDetails]:
-    result = [details for recipe in recipes if
-              (details := _calculate_profit_details_for_recipe(recipe, multiplier, use_focus))
-              and details.profit_percentage < _PROFIT_LIMIT]
-    return sorted(result, key=lambda x: x.profit_percentage, reverse=True)
+def _check_stop_requested() -> None:
+    # every calculation key is saved in its own transaction, so stopping between them leaves consistent results
+    if _stop_requested.is_set():
+        logging.info('Calculations interrupted')
+        raise CalculationsInterrupted()
 
 
-def _create_calculation_key(limitations: str, recipe_type: str, use_focus: bool) -> str:
-    use_focus_str = 'WITH_FOCUS' if use_focus else 'NO_FOCUS'
-    return f'{recipe_type}_{limitations}_{use_focus_str}'
+def _save_calculations(session: BackendSession, calculations_updates: list[CalculationsUpdateRecord]):
+    for calculation_update in calculations_updates:
+        _check_stop_requested()
+        with metrics.span('save_calculations', key=calculation_update.type_key):
+            session.bulk_insert_calculations_update(calculation_update)
+            session.delete_previous_calculation_updates(calculation_update.type_key)
+        calculations_export.export(calculation_update)
+
+
+def _calculate_profits(recipe_type: str, limitations: str, recipes: list[Recipe], use_focus: bool,
+                       affected_recipes: Optional[list[Recipe]] = None) -> list[CalculationsUpdateRecord]:
+    type_key = create_calculation_key(limitations, recipe_type, use_focus)
+    _check_stop_requested()
+    with metrics.span('calculate_profits', key=type_key), profiling.profile(type_key):
+        if limitations == 'PER_CITY':
+            result = [CalculationsUpdateRecord(type_key=key, profit_details=profit_details)
+                      for key, profit_details in
+                      _calculate_profits_per_city(recipes, use_focus, type_key, affected_recipes).items()]
+        else:
+            multiplier = _MULTIPLIERS[limitations]
+            chain_costs = None if recipe_type != 'CHAIN' else crafting_chain.calculate_chain_costs(multiplier,
+                                                                                                   use_focus)
+            profit_details = _calculate_ranked_profits(type_key, recipes, multiplier, use_focus, affected_recipes,
+                                                       chain_costs)
+            result = [CalculationsUpdateRecord(type_key=type_key, profit_details=profit_details)]
+    logging.debug(f'{type_key} loaded')
+    return result
 
 
-def start_background_calculator_job() -> None:
-    try:
-        scheduler = BackgroundScheduler(daemon=True)
-        hours = config.CONFIG['APP']['WEBAPP']['UPDATE_HOURS']
-        hours = hours if isinstance(hours, list) else [hours]
-        hours = [str(hour) for hour in hours]
-        scheduler.add_job(update_calculations)
-        scheduler.add_job(update_calculations, 'cron', hour=','.join(hours))
-        scheduler.start()
-        while True:
-            sleep(60)
-    except (KeyboardInterrupt, SystemExit):
-        pass
+def _calculate_profits_per_city(recipes: list[Recipe], use_focus: bool, type_key: str,
+                                affected_recipes: Optional[list[Recipe]] = None
+                                ) -> dict[str, list[ProfitDetailsRecord]]:
+    keys = [f'{type_key}_{city_name.upper().replace(" ", "_")}' for city_name in cities.cities_names()]
+    return {key: _calculate_ranked_profits(key, recipes, multiplier, use_focus, affected_recipes)
+            for key, multiplier in zip(keys, _MULTIPLIERS['PER_CITY'])}
 
 
-if __name__ == '__main__':
-    start_background_calculator_job()
+def _calculate_ranked_profits(type_key: str, recipes: list[Recipe], multiplier: ndarray, use_focus: bool,
+                              affected_recipes: Optional[list[Recipe]],
+                              chain_costs: Optional[ChainCosts] = None) -> list[ProfitDetailsRecord]:
+    previous_results = _latest_results.get(type_key, None)
+    if affected_recipes is None or previous_results is None:
+        evaluations = _evaluate_recipes(recipes, multiplier, use_focus, chain_costs)
+        scores = _score_evaluations(evaluations, _recipe_positions(recipes))
+        results = {recipe_id: _summarize_profit(evaluations[recipe_id], multiplier, chain_costs)
+                   for recipe_id in _select_top_profits(scores, _TOP_K)}
+    else:
+        results, scores = _merge_recalculated_profits(previous_results, recipes, affected_recipes, multiplier,
+                                                      use_focus)
+    if _DELTA_RECALCULATION:
+        _latest_results[type_key] = results, scores
+    return list(results.values())
+
+
+def _merge_recalculated_profits(previous_results: tuple[dict[int, ProfitDetailsRecord],
+                                                        dict[int, tuple[float, str, int]]],
+                                recipes: list[Recipe], affected_recipes: list[Recipe], multiplier: ndarray,
+                                use_focus: bool
+                                ) -> tuple[dict[int, ProfitDetailsRecord], dict[int, tuple[float, str, int]]]:
+    # scores of all recipes are kept so recipes which weren't in the top before can take places of the affected ones
+    previous_details, previous_scores = previous_results
+    positions = _recipe_positions(recipes)
+    recalculated = _evaluate_recipes(affected_recipes, multiplier, use_focus)
+    affected_ids = {id(recipe) for recipe in affected_recipes}
+    scores = {recipe_id: score for recipe_id, score in previous_scores.items() if recipe_id not in affected_ids}
+    scores.update(_score_evaluations(recalculated, positions))
+    recipes_by_id = None
+    while True:
+        top_profits = _select_top_profits(scores, _TOP_K)
+        # recipes entering the top have no details to reuse, they are evaluated with the current prices (which moved
+        # less than the tolerance) and ranked again by the new score, dropped if they no longer pass the filters
+        entering = [recipe_id for recipe_id in top_profits
+                    if recipe_id not in recalculated and recipe_id not in previous_details]
+        if not entering:
+            break
+        recipes_by_id = recipes_by_id or {id(recipe): recipe for recipe in recipes}
+        evaluations = _evaluate_recipes([recipes_by_id[recipe_id] for recipe_id in entering], multiplier, use_focus)
+        for recipe_id in entering:
+            del scores[recipe_id]
+        scores.update(_score_evaluations(evaluations, positions))
+        recalculated.update(evaluations)
+    results = {recipe_id: _summarize_profit(recalculated[recipe_id], multiplier) if recipe_id in recalculated
+               else previous_details[recipe_id] for recipe_id in top_profits}
+    return results, scores
+
+
+def _calculate_profits_for_recipes(recipes: list[Recipe], multiplier: ndarray, use_focus: bool,
+                                   chain_costs: Optional[ChainCosts] = None,
+                                   top_k: Optional[int] = _TOP_K) -> dict[int, ProfitDetailsRecord]:
+    evaluations = _evaluate_recipes(recipes, multiplier, use_focus, chain_costs)
+    return {recipe_id: _summarize_profit(evaluations[recipe_id], multiplier, chain_costs)
+            for recipe_id in _select_top_profits(_score_evaluations(evaluations, _recipe_positions(recipes)), top_k)}
+
+
+def _evaluate_recipes(recipes: list[Recipe], multiplier: ndarray, use_focus: bool,
+                      chain_costs: Optional[ChainCosts] = None) -> dict[int, _ProfitEvaluation]:
+    evaluated = [(id(recipe), evaluation) for recipe in recipes if
+                 (evaluation := _evaluate_recipe(recipe, multiplier, use_focus, chain_costs))]
+    metrics.increment('recipes_evaluated', len(recipes))
+    metrics.increment('recipes_skipped_missing_prices', len(recipes) - len(evaluated))
+    return {recipe_id: evaluation for recipe_id, evaluation in evaluated
+            if evaluation.profit_percentage < _PROFIT_LIMIT}
+
+
+def _recipe_positions(recipes: list[Recipe]) -> dict[int, int]:
+    return {id(recipe): position for position, recipe in enumerate(recipes)}
+
+
+def _score_evaluations(evaluations: dict[int, _ProfitEvaluation],
+                       positions: dict[int, int]) -> dict[int, tuple[float, str, int]]:
+    # the position in the list of all recipes breaks ties, the same in full and delta recalculations
+    subcategories_ids = item_metadata.get_metadata_table().subcategories_ids
+    return {recipe_id: (evaluation.profit_percentage if _RANKING != 'DAILY_PROFIT' else evaluation.daily_profit,
+                        subcategories_ids[item_metadata.get_item_index(evaluation.recipe.result_item_id)],
+                        positions[recipe_id])
+            for recipe_id, evaluation in evaluations.items()}
+
+
+def _select_top_profits(scores: dict[int, tuple[float, str, int]], top_k: Optional[int]) -> list[int]:
+    # ids of recipes ranked by profit (see _RANKING), only top_k of every category are kept - the top of all
+    # categories together is always a part of them; ties keep the order of recipes
+    ranked = ((ranking_value, position, recipe_id)
+              for recipe_id, (ranking_value, _, position) in scores.items())
+    if top_k is not None:
+        categories = defaultdict(list)
+        for score, (_, category, _) in zip(ranked, scores.values()):
+            categories[category].append(score)
+        ranked = [score for category_scores in categories.values()
+                  for score in heapq.nlargest(top_k, category_scores, key=lambda x: (x[0], -x[1]))]
+        metrics.increment('recipes_dropped_by_top_k', len(scores) - len(ranked))
+    return [recipe_id for _, _, recipe_id in sorted(ranked, key=lambda x: (-x[0], x[1]))]
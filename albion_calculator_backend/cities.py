@@ -1,4 +1,6 @@
-_CITIES = ['Fort Sterling', 'Lymhurst', 'Bridgewatch', 'Martlock', 'Thetford', 'Caerleon']
+from albion_calculator_backend import config
+
+_CITIES = [city['NAME'] for city in config.CONFIG['CITIES']]
 
 
 def city_at_index(index: int) -> str:
@@ -7,3 +9,7 @@ def city_at_index(index: int) -> str:
 
 def cities_names() -> list[str]:
     return _CITIES[:]
+
+
+def cities_count() -> int:
+    return len(_CITIES)
@@ -5,7 +5,8 @@ import yaml
 
 
 def get_api_params() -> dict[str, any]:
-    return {k: _to_str_if_list(v) for k, v in CONFIG['DATA_PROJECT']['PARAMS'].items()}
+    params = {'LOCATIONS': [city['NAME'] for city in CONFIG['CITIES']]} | CONFIG['DATA_PROJECT']['PARAMS']
+    return {k: _to_str_if_list(v) for k, v in params.items()}
 
 
 def _read_yaml(file_path: pathlib.Path) -> Union[dict[Hashable, Any], list, None]:
@@ -0,0 +1,115 @@
+import logging
+from dataclasses import dataclass
+from math import nan, inf
+
+import numpy as np
+from numpy import ndarray
+
+from albion_calculator_backend import items, market, crafting_modifiers, fees
+from albion_calculator_backend.models import Recipe, RecipeType
+
+BOUGHT = -1
+
+_VISITING, _VISITED = 1, 2
+
+
+@dataclass(frozen=True)
+class ChainCosts:
+    # item_id -> cheapest cost of a single unit available in every city, either bought or produced
+    costs: dict[str, ndarray]
+    # item_id -> city where the unit is bought or produced, for every city
+    origins: dict[str, ndarray]
+    # item_id -> index of the production recipe used or BOUGHT, for every city
+    recipes: dict[str, ndarray]
+
+    def is_produced(self, item_id: str, city_index: int) -> bool:
+        return self.recipes[item_id][city_index] != BOUGHT
+
+
+def calculate_chain_costs(multiplier: ndarray, use_focus: bool) -> ChainCosts:
+    # ingredients always come before items produced from them so every item is evaluated exactly once
+    chain_costs = ChainCosts(costs={}, origins={}, recipes={})
+    for item_id in _production_order:
+        costs, origins = _find_best_deals(market.get_prices_for_item(item_id), multiplier)
+        recipes = np.full(len(costs), BOUGHT)
+        for recipe_index, recipe in enumerate(_production_recipes.get(item_id, [])):
+            production_costs, production_cities = _find_best_deals(
+                _calculate_production_costs(recipe, use_focus, chain_costs, multiplier), multiplier)
+            cheaper = production_costs < np.where(np.isnan(costs), inf, costs)
+            costs = np.where(cheaper, production_costs, costs)
+            origins = np.where(cheaper, production_cities, origins)
+            recipes = np.where(cheaper, recipe_index, recipes)
+        chain_costs.costs[item_id] = costs
+        chain_costs.origins[item_id] = origins
+        chain_costs.recipes[item_id] = recipes
+    return chain_costs
+
+
+def _calculate_production_costs(recipe: Recipe, use_focus: bool, chain_costs: ChainCosts,
+                                multiplier: ndarray) -> ndarray:
+    # cost of a single product for every production city
+    return_rates = crafting_modifiers.get_return_rates_vector(recipe.result_item_id, use_focus,
+                                                              market.PRICE_DTYPE)[:, 0]
+    total_costs = np.zeros(len(return_rates), dtype=market.PRICE_DTYPE)
+    for ingredient in recipe.ingredients:
+        ingredient_costs = chain_costs.costs.get(ingredient.item_id, None)
+        if ingredient_costs is None:
+            # ingredient depends on this item (cycle), it can only be bought
+            ingredient_costs, _ = _find_best_deals(market.get_prices_for_item(ingredient.item_id), multiplier)
+        ingredient_costs = ingredient_costs * ingredient.quantity
+        if recipe.recipe_type == RecipeType.CRAFTING and ingredient.max_return_rate != 0:
+            ingredient_costs = ingredient_costs * return_rates
+        total_costs = total_costs + ingredient_costs
+    return fees.add_production_fees(total_costs, recipe) / recipe.result_quantity
+
+
+def _find_best_deals(costs: ndarray, multiplier: ndarray) -> tuple[ndarray, ndarray]:
+    # cheapest cost after transport into every city and the city it comes from
+    costs_matrix = costs * multiplier
+    missing_costs = np.isnan(costs_matrix)
+    origins = np.where(missing_costs, inf, costs_matrix).argmin(axis=1)
+    best_costs = costs_matrix[np.arange(len(costs_matrix)), origins]
+    best_costs[missing_costs.all(axis=1)] = nan
+    return best_costs, origins
+
+
+def _load_production_recipes() -> dict[str, list[Recipe]]:
+    production_recipes = {}
+    for recipe in items.get_all_crafting_recipes() + items.get_all_upgrade_recipes():
+        production_recipes.setdefault(recipe.result_item_id, []).append(recipe)
+    return production_recipes
+
+
+def _find_production_order() -> list[str]:
+    # iterative depth-first search over the dependency graph, an item is added after all of its ingredients
+    order, state, cycles_count = [], {}, 0
+    for root_id in _production_recipes:
+        if root_id in state:
+            continue
+        state[root_id] = _VISITING
+        stack = [(root_id, iter(_find_ingredients_ids(root_id)))]
+        while stack:
+            item_id, ingredients_ids = stack[-1]
+            for ingredient_id in ingredients_ids:
+                if ingredient_id not in state:
+                    state[ingredient_id] = _VISITING
+                    stack.append((ingredient_id, iter(_find_ingredients_ids(ingredient_id))))
+                    break
+                cycles_count += state[ingredient_id] == _VISITING
+            else:
+                stack.pop()
+                state[item_id] = _VISITED
+                order.append(item_id)
+    if cycles_count:
+        logging.warning(f'{cycles_count} cycles in crafting recipes, ingredients closing them are only bought')
+    return order
+
+
+def _find_ingredients_ids(item_id: str) -> list[str]:
+    return list(dict.fromkeys(ingredient.item_id for recipe in _production_recipes.get(item_id, [])
+                              for ingredient in recipe.ingredients))
+
+
+_production_recipes = _load_production_recipes()
+
+_production_order = _find_production_order()
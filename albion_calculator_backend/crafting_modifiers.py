@@ -24,10 +24,10 @@ def get_craftable_categories() -> list[str]:
     return [subcategory for city in _crafting_bonus.values() for subcategory in city.keys()]
 
 
-def get_return_rates_vector(item_id: str, use_focus: bool = False) -> ndarray:
+def get_return_rates_vector(item_id: str, use_focus: bool = False, dtype: np.dtype = np.float64) -> ndarray:
     item_subcategory = items.get_item_subcategory(item_id)
     vector = [_get_return_rate(city, item_subcategory, use_focus) for city in cities_names()]
-    return np.atleast_2d(1 - np.array(vector)).T
+    return np.atleast_2d(1 - np.array(vector)).T.astype(dtype, copy=False)
 
 
 def _load_crafting_modifiers() -> dict[str, dict[str, float]]:
@@ -44,7 +44,8 @@ def _load_crafting_modifiers() -> dict[str, dict[str, float]]:
 
 def _get_return_rate(city_id: str, item_category: str, use_focus: bool = False) -> float:
     focus_bonus = 0.59 if use_focus else 0
-    local_crafting_bonus = _crafting_bonus[city_id].get(item_category, 0) + _BASE_CRAFTING_BONUS + focus_bonus
+    # cities without a crafting location (e.g. Black Market) get only the base bonus
+    local_crafting_bonus = _crafting_bonus.get(city_id, {}).get(item_category, 0) + _BASE_CRAFTING_BONUS + focus_bonus
     return round(1 - 1 / (1 + local_crafting_bonus), 3)
 
 
@@ -1,18 +1,65 @@
 import logging
 import os
 
-from sqlalchemy import desc, create_engine
+from sqlalchemy import desc, create_engine, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.orm import sessionmaker
 
-from albion_calculator_backend import database_models
+from albion_calculator_backend import config, database_models, metrics
 from albion_calculator_backend.database_models import CalculationsUpdate, ProfitDetails, IngredientDetails
+from albion_calculator_backend.models import CalculationsUpdateRecord
 
 SQLALCHEMY_DATABASE_URL = os.environ.get("SQLALCHEMY_DATABASE_URI")
-
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# optional read replica for the web app, it reads from the primary database without it
+SQLALCHEMY_READER_DATABASE_URL = os.environ.get("SQLALCHEMY_READER_DATABASE_URI")
+
+_POOL_CONFIG = config.CONFIG['APP'].get('DATABASE', {})
+_SQLITE_CONFIG = _POOL_CONFIG.get('SQLITE', {})
+
+
+def _create_engine(url: str, read_only: bool = False) -> Engine:
+    options = {'pool_pre_ping': _POOL_CONFIG.get('POOL_PRE_PING', True),
+               'pool_recycle': _POOL_CONFIG.get('POOL_RECYCLE', 1800)}
+    if make_url(url).get_backend_name() == 'sqlite':
+        # SQLite uses pools without a fixed size
+        new_engine = create_engine(url, **options)
+        event.listen(new_engine, 'connect', lambda connection, _: _configure_sqlite_connection(connection, read_only))
+        return new_engine
+    options |= {'pool_size': _POOL_CONFIG.get('POOL_SIZE', 5),
+                'max_overflow': _POOL_CONFIG.get('MAX_OVERFLOW', 10),
+                'pool_timeout': _POOL_CONFIG.get('POOL_TIMEOUT', 30)}
+    return create_engine(url, **options)
+
+
+def _configure_sqlite_connection(connection, read_only: bool) -> None:
+    # in WAL mode pages are read while the worker writes a new generation, the writer waits for locks up to
+    # BUSY_TIMEOUT_MS instead of failing; foreign keys make deletes of old generations cascade like on InnoDB
+    cursor = connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={_SQLITE_CONFIG.get('JOURNAL_MODE', 'WAL')}")
+    cursor.execute(f"PRAGMA synchronous={_SQLITE_CONFIG.get('SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={int(_SQLITE_CONFIG.get('BUSY_TIMEOUT_MS', 5000))}")
+    cursor.execute('PRAGMA foreign_keys=ON')
+    if read_only:
+        cursor.execute('PRAGMA query_only=ON')
+    cursor.close()
+
+
+def _create_reader_engine() -> Engine:
+    if SQLALCHEMY_READER_DATABASE_URL:
+        return _create_engine(SQLALCHEMY_READER_DATABASE_URL, read_only=True)
+    # a separate pool, reads don't wait for connections busy with bulk writes; in-memory SQLite can't be shared
+    if make_url(SQLALCHEMY_DATABASE_URL).database in (None, '', ':memory:'):
+        return engine
+    return _create_engine(SQLALCHEMY_DATABASE_URL, read_only=True)
+
+
+# the worker writes calculations through engine, the web app only reads through reader_engine
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+reader_engine = _create_reader_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-db = SessionLocal()
+ReaderSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=reader_engine)
+# gunicorn --preload forks workers after the import, connections of the parent must not be reused by them
+os.register_at_fork(after_in_child=lambda: (engine.dispose(close=False), reader_engine.dispose(close=False)))
 
 
 class BackendSession:
@@ -25,10 +72,9 @@ class BackendSession:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.session.close()
 
-    def bulk_insert_calculations_update(self, calculations_update: CalculationsUpdate):
-        _assign_ids(calculations_update, *self._get_next_ids())
-        calculations_update_raw, ingredient_details_raw, profit_details_raw = _extract_raw_attributes(
-            calculations_update)
+    def bulk_insert_calculations_update(self, calculations_update: CalculationsUpdateRecord):
+        calculations_update_raw, ingredient_details_raw, profit_details_raw = _create_raw_rows(
+            calculations_update, *self._get_next_ids())
 
         self.session.bulk_insert_mappings(
             CalculationsUpdate,
@@ -43,10 +89,12 @@ class BackendSession:
             ingredient_details_raw
         )
         self.session.commit()
+        metrics.increment('rows_written', len(profit_details_raw), table=ProfitDetails.__tablename__)
+        metrics.increment('rows_written', len(ingredient_details_raw), table=IngredientDetails.__tablename__)
         logging.debug(f'{len(calculations_update.profit_details)} calculations saved to DB')
 
     def delete_previous_calculation_updates(self, type_key: str):
-        latest_calculation_update = db.query(CalculationsUpdate.id) \
+        latest_calculation_update = self.session.query(CalculationsUpdate.id) \
             .filter(CalculationsUpdate.type_key == type_key) \
             .order_by(desc(CalculationsUpdate.id)).first()
         if latest_calculation_update:
@@ -66,28 +114,23 @@ class BackendSession:
         return calculation_update_id, profit_details_id, ingredient_details_id
 
 
-def _assign_ids(calculations_update, calculation_update_id, profit_details_id, ingredient_details_id):
-    calculations_update.id = calculation_update_id
+def _create_raw_rows(calculations_update, calculation_update_id, profit_details_id, ingredient_details_id):
+    # records already hold column values, rows only need ids and foreign keys
+    calculations_update_raw = [{'id': calculation_update_id, 'type_key': calculations_update.type_key}]
+    profit_details_raw, ingredient_details_raw = [], []
     for profit_details in calculations_update.profit_details:
-        profit_details.id = profit_details_id
-        profit_details.calculations_updates_id = calculation_update_id
+        profit_details_row = profit_details._asdict()
+        del profit_details_row['ingredients_details']
+        profit_details_row['id'] = profit_details_id
+        profit_details_row['calculations_updates_id'] = calculation_update_id
+        profit_details_raw.append(profit_details_row)
         for ingredient_details in profit_details.ingredients_details:
-            ingredient_details.id = ingredient_details_id
-            ingredient_details.profit_details_id = profit_details_id
+            ingredient_details_row = ingredient_details._asdict()
+            ingredient_details_row['id'] = ingredient_details_id
+            ingredient_details_row['profit_details_id'] = profit_details_id
+            ingredient_details_raw.append(ingredient_details_row)
             ingredient_details_id += 1
         profit_details_id += 1
-
-
-def _extract_raw_attributes(calculations_update):
-    calculations_updates_columns = CalculationsUpdate.__table__.columns
-    calculations_update_raw = [{c.name: getattr(calculations_update, c.name) for c in calculations_updates_columns}]
-    profit_details_columns = ProfitDetails.__table__.columns
-    profit_details_raw = [{c.name: getattr(profit_details, c.name) for c in profit_details_columns} for
-                          profit_details in calculations_update.profit_details]
-    ingredient_details_columns = IngredientDetails.__table__.columns
-    ingredient_details_raw = [{c.name: getattr(ingredient_details, c.name) for c in ingredient_details_columns}
-                              for profit_details in calculations_update.profit_details
-                              for ingredient_details in profit_details.ingredients_details]
     return calculations_update_raw, ingredient_details_raw, profit_details_raw
 
 
@@ -95,5 +138,23 @@ def init_db():
     database_models.mapper_registry.metadata.create_all(bind=engine)
 
 
+def upgrade_db():
+    # create_all doesn't alter existing tables, columns and indexes added to the models later are added here
+    metadata = database_models.mapper_registry.metadata
+    metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                                            f'{column.type.compile(engine.dialect)}'))
+                    logging.info(f'Column {table.name}.{column.name} added')
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
 def drop_db():
     database_models.mapper_registry.metadata.drop_all(bind=engine)
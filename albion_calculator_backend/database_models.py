@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship, registry
 
 from albion_calculator_backend.models import RecipeType
@@ -27,14 +27,16 @@ class IngredientDetails:
     total_cost_with_returns: float = field(default=None, metadata={"sa": Column(Float)})
     source_city: str = field(default=None, metadata={"sa": Column(String(100))})
     profit_details_id: int = field(default=None, metadata={
-        "sa": Column(Integer, ForeignKey('profit_details.id', ondelete="CASCADE"))})
+        "sa": Column(Integer, ForeignKey('profit_details.id', ondelete="CASCADE"), index=True)})
 
 
 @mapper_registry.mapped
 @dataclass
 class ProfitDetails:
     __tablename__ = 'profit_details'
-    __table_args__ = {'mysql_engine': 'InnoDB'}
+    # results of a calculation filtered by the volume sold
+    __table_args__ = (Index('ix_profit_details_update_volume', 'calculations_updates_id', 'sellable_volume'),
+                      {'mysql_engine': 'InnoDB'})
     __sa_dataclass_metadata_key__ = "sa"
 
     id: int = field(
@@ -53,6 +55,8 @@ class ProfitDetails:
     journals_filled: float = field(default=None, metadata={"sa": Column(Float)})
     profit_with_journals: float = field(default=None, metadata={"sa": Column(Float)})
     profit_percentage: float = field(default=None, metadata={"sa": Column(Float)})
+    sellable_volume: float = field(default=None, metadata={"sa": Column(Float)})
+    daily_profit: float = field(default=None, metadata={"sa": Column(Float)})
     destination_city: str = field(default=None, metadata={"sa": Column(String(100))})
     production_city: str = field(default=None, metadata={"sa": Column(String(100))})
     ingredients_details: list[IngredientDetails] = field(default=None,
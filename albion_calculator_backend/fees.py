@@ -0,0 +1,27 @@
+import numpy as np
+from numpy import ndarray
+
+from albion_calculator_backend import config, market
+from albion_calculator_backend.models import Recipe, RecipeType
+
+_FEES_CONFIG = config.CONFIG.get('FEES', {})
+
+
+def _rates_per_city(name: str) -> ndarray:
+    # a city can override the default rate
+    return np.array([float(city.get(name, _FEES_CONFIG.get(name, 0))) for city in config.CONFIG['CITIES']],
+                    dtype=market.PRICE_DTYPE)
+
+
+# part of the price which is left after selling in every city, sales tax and setup fee of the sell order
+SALE_FACTORS = 1 - _rates_per_city('SALES_TAX') - _rates_per_city('SETUP_FEE')
+
+# usage fee of crafting stations in every city as a part of the ingredients cost
+STATION_FEE_FACTORS = 1 + _rates_per_city('STATION_FEE')
+
+
+def add_production_fees(ingredients_costs: ndarray, recipe: Recipe) -> ndarray:
+    # costs of a single craft in every production city, transport doesn't use stations
+    if recipe.recipe_type == RecipeType.TRANSPORT:
+        return ingredients_costs
+    return ingredients_costs * STATION_FEE_FACTORS + recipe.silver_cost
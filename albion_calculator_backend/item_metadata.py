@@ -0,0 +1,45 @@
+import sys
+from typing import NamedTuple
+
+from albion_calculator_backend import items, shop_categories
+
+
+class ItemMetadataTable(NamedTuple):
+    # columns aligned with sorted items ids, values of an item are gathered by its index (see get_item_index)
+    items_ids: list[str]
+    names: list[str]
+    subcategories_ids: list[str]
+    subcategories_names: list[str]
+    tiers: list[str]
+
+
+def get_item_index(item_id: str) -> int:
+    return _items_indexes[item_id]
+
+
+def items_count() -> int:
+    return len(_metadata_table.items_ids)
+
+
+def get_metadata_table() -> ItemMetadataTable:
+    return _metadata_table
+
+
+def _build_metadata_table() -> tuple[dict[str, int], ItemMetadataTable]:
+    # repeated strings are interned so every row shares them
+    items_ids = sorted(items._items_data)
+    subcategories_names = {}
+    table = ItemMetadataTable(items_ids=items_ids, names=[], subcategories_ids=[], subcategories_names=[], tiers=[])
+    for item_id in items_ids:
+        item = items._items_data[item_id]
+        subcategory_id = sys.intern(item.subcategory)
+        if subcategory_id not in subcategories_names:
+            subcategories_names[subcategory_id] = sys.intern(shop_categories.get_category_pretty_name(subcategory_id))
+        table.names.append(item.name)
+        table.subcategories_ids.append(subcategory_id)
+        table.subcategories_names.append(subcategories_names[subcategory_id])
+        table.tiers.append(sys.intern(items.get_item_tier(item_id)))
+    return {item_id: index for index, item_id in enumerate(items_ids)}, table
+
+
+_items_indexes, _metadata_table = _build_metadata_table()
@@ -1,16 +1,36 @@
 import json
-from typing import Optional
+from typing import Optional, NamedTuple
 
+import numpy as np
+from numpy import ndarray
+
+from albion_calculator_backend import items, item_metadata
 from albion_calculator_backend.items_parser import ITEMS_JSON_FILE
 
 _CRAFTING_TYPES = ['WARRIOR', 'HUNTER', 'MAGE', 'TOOLMAKER']
 
+NO_JOURNAL = -1
+
+
+class JournalTable(NamedTuple):
+    # journal index -> id of the journal and silver cost of an empty one
+    journals_ids: list[str]
+    costs: ndarray
+    # item index (see item_metadata) -> index of the journal filled by crafting the item or NO_JOURNAL
+    journal_indexes: ndarray
+    # item index -> journals filled by crafting a single item
+    journals_filled: ndarray
+
 
 def get_journal_for_item(item_id: str) -> Optional[dict]:
     stripped_item_id = item_id.split('@')[0]
     return _journals_grouped_by_valid_item.get(stripped_item_id, None)
 
 
+def get_journal_table() -> JournalTable:
+    return _journal_table
+
+
 def _load_journals() -> dict[str, dict]:
     raw_journals_data = _read_journals_from_items_file()
     raw_crafting_journals_data = _filter_crafting_journals(raw_journals_data)
@@ -45,4 +65,25 @@ def _group_journals_by_item(journals_data: dict[str, dict]) -> dict[str, dict]:
             for item_id in journal['valid_items']}
 
 
+def _build_journal_table() -> JournalTable:
+    # everything which doesn't depend on prices, journal profits are then calculated for all items at once
+    journals_ids, costs, journals_indexes_by_id = [], [], {}
+    journal_indexes = np.full(item_metadata.items_count(), NO_JOURNAL)
+    journals_filled = np.zeros(item_metadata.items_count())
+    for item_index, item_id in enumerate(item_metadata.get_metadata_table().items_ids):
+        journal = get_journal_for_item(item_id)
+        if journal is None:
+            continue
+        if journal['item_id'] not in journals_indexes_by_id:
+            journals_indexes_by_id[journal['item_id']] = len(journals_ids)
+            journals_ids.append(journal['item_id'])
+            costs.append(journal['cost'])
+        journal_indexes[item_index] = journals_indexes_by_id[journal['item_id']]
+        journals_filled[item_index] = items.get_item_crafting_fame(item_id) / journal['max_fame']
+    return JournalTable(journals_ids=journals_ids, costs=np.array(costs, dtype=float),
+                        journal_indexes=journal_indexes, journals_filled=journals_filled)
+
+
 _journals_grouped_by_valid_item = _load_journals()
+
+_journal_table = _build_journal_table()
@@ -1,4 +1,6 @@
 import logging
+import os
+import threading
 from collections import defaultdict
 from datetime import datetime, timedelta
 from math import nan
@@ -7,8 +9,8 @@ from typing import Generator, Any
 import numpy as np
 from numpy import ndarray
 
-from albion_calculator_backend import items, config
-from albion_calculator_backend.cities import cities_names
+from albion_calculator_backend import items, config, metrics, profiling, shared_prices
+from albion_calculator_backend.cities import cities_names, cities_count
 from albion_calculator_backend.price_api import get_prices
 from albion_calculator_backend.price_cache import local_price_cache
 
@@ -16,10 +18,28 @@ _DOWNLOAD_CHUNK_SIZE = config.CONFIG['DATA_PROJECT']['DOWNLOAD_CHUNK_SIZE']
 
 _DEVIATION_THRESHOLD = 4
 
+# precision of prices and of everything calculated from them, float32 halves the memory of price and cost arrays;
+# can be overridden with ALBION_CALCULATOR_PRECISION
+PRICE_DTYPE = np.dtype(os.environ.get('ALBION_CALCULATOR_PRECISION',
+                                      config.CONFIG['APP']['CALCULATOR'].get('PRECISION', 'float64')))
+
+_PUBLISH_SHARED_PRICES = config.CONFIG['APP'].get('SHARED_PRICES', {}).get('PUBLISH', False)
+
 _items_prices = {}
 
 _estimated_real_prices = {}
 
+# item_id -> items sold during the last 24h in every city, 0 where nothing was sold
+_sales_volumes = {}
+
+_loading_lock = threading.Lock()
+
+# incremented whenever prices are updated, lets results calculated from older prices be recognized
+_price_generation = 0
+
+# prices published by the worker and mapped by this process, if any
+_shared_prices = None
+
 
 def get_price_for_item_in_city(item_id: str, city_index: int) -> float:
     return float(get_prices_for_item(item_id)[city_index])
@@ -28,13 +48,42 @@ def get_price_for_item_in_city(item_id: str, city_index: int) -> float:
 def get_prices_for_item(item_id: str) -> ndarray:
     prices = _estimated_real_prices.get(item_id, None)
     if prices is None:
-        a = np.empty((6,))
-        a[:] = nan
-        return a
+        return np.full(cities_count(), nan, dtype=PRICE_DTYPE)
 
     return prices
 
 
+def get_sales_volumes_for_item(item_id: str) -> ndarray:
+    volumes = _sales_volumes.get(item_id, None)
+    if volumes is None:
+        return np.zeros(cities_count(), dtype=PRICE_DTYPE)
+    return volumes
+
+
+def get_price_generation() -> int:
+    return _price_generation
+
+
+def ensure_prices_loaded() -> bool:
+    # maps the latest prices published by the worker, a newer version bumps the price generation;
+    # never fetches them from the API, False until the worker publishes something
+    with _loading_lock:
+        return _load_shared_prices()
+
+
+def _load_shared_prices() -> bool:
+    global _shared_prices, _estimated_real_prices, _sales_volumes, _price_generation
+    loaded = shared_prices.load_if_changed(_shared_prices)
+    if loaded is None:
+        return _shared_prices is not None
+    _shared_prices = loaded
+    _estimated_real_prices = loaded.prices_by_item()
+    _sales_volumes = loaded.sales_volumes_by_item()
+    _price_generation += 1
+    logging.info(f'Shared prices version {loaded.version} mapped')
+    return True
+
+
 def get_avg_price_for_item(item_id: str) -> Any:
     return np.nanmean(get_prices_for_item(item_id))
 
@@ -49,6 +98,11 @@ def _estimate_real_prices_for_item(item_id: str) -> ndarray:
     return np.array([_estimate_real_price(prices_in_city) for prices_in_city in _items_prices[item_id]])
 
 
+def _estimate_sales_volumes_for_item(item_id: str) -> ndarray:
+    return np.array([prices_in_city.get('items_sold_24h', 0) for prices_in_city in _items_prices[item_id]],
+                    dtype=PRICE_DTYPE)
+
+
 def _estimate_real_price(prices_in_city: dict) -> Any:
     if not prices_in_city:
         return nan
@@ -138,6 +192,7 @@ def _summarize_history_price(history_price: dict) -> dict:
     return {'item_id': history_price['item_id'],
             'latest_timestamp': str(latest_timestamp),
             'items_sold': items_sold,
+            'items_sold_24h': items_sold_count_24h,
             'avg_price_24h': avg_price_24h}
 
 
@@ -182,15 +237,23 @@ def _correct_erroneous_prices(estimated_prices: dict) -> dict:
         for price in prices_for_item:
             corrected_price = price if lower_bound <= price <= upper_bound else nan
             corrected_prices_for_item.append(corrected_price)
-        corrected_prices[item_id] = np.array(corrected_prices_for_item)
+        corrected_prices[item_id] = np.array(corrected_prices_for_item, dtype=PRICE_DTYPE)
     return corrected_prices
 
 
-def update_prices() -> None:
-    global _items_prices, _estimated_real_prices
+def update_prices(publish: bool = False) -> None:
+    global _items_prices, _estimated_real_prices, _sales_volumes, _price_generation
     items_ids = items.get_all_items_ids()
     logging.info('Starting fetching prices')
-    _items_prices = _load_all_prices(items_ids)
+    with metrics.span('load_all_prices'), profiling.trace_allocations('update_prices'):
+        _items_prices = _load_all_prices(items_ids)
     logging.info('Prices fetched')
-    estimated_prices = {item_id: _estimate_real_prices_for_item(item_id) for item_id in items_ids}
-    _estimated_real_prices = _correct_erroneous_prices(estimated_prices)
+    with metrics.span('estimate_real_prices'):
+        estimated_prices = {item_id: _estimate_real_prices_for_item(item_id) for item_id in items_ids}
+        _estimated_real_prices = _correct_erroneous_prices(estimated_prices)
+        _sales_volumes = {item_id: _estimate_sales_volumes_for_item(item_id) for item_id in items_ids}
+    _price_generation += 1
+    if publish and _PUBLISH_SHARED_PRICES:
+        with metrics.span('publish_shared_prices'):
+            shared_prices.publish(_estimated_real_prices, _sales_volumes)
+    metrics.increment('items_priced', len(items_ids))
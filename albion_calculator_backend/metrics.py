@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Generator, Optional
+
+from albion_calculator_backend import config
+
+_METRICS_CONFIG = config.CONFIG['APP'].get('METRICS', {})
+_PREFIX = 'albion_calculator_'
+
+_lock = threading.Lock()
+
+# (name, labels) -> value
+_counters = defaultdict(float)
+
+# (name, labels) -> [count, sum, last]
+_summaries = {}
+
+
+def increment(name: str, value: float = 1, **labels: str) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] += value
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        summary = _summaries.setdefault(key, [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += value
+        summary[2] = value
+
+
+@contextmanager
+def span(name: str, **labels: str) -> Generator:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('span_seconds', elapsed, span=name, **labels)
+        _log_structured({'event': 'span', 'span': name, 'seconds': round(elapsed, 6)} | labels)
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
+
+
+def export_prometheus() -> str:
+    with _lock:
+        counters = sorted(_counters.items())
+        summaries = sorted(_summaries.items())
+    lines = []
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f'# TYPE {_PREFIX}{name}_total counter')
+        lines.extend(f'{_PREFIX}{name}_total{_format_labels(labels)} {_format_value(value)}'
+                     for (counter_name, labels), value in counters if counter_name == name)
+    for name in sorted({name for (name, _), _ in summaries}):
+        lines.append(f'# TYPE {_PREFIX}{name} summary')
+        for (summary_name, labels), (count, total, _) in summaries:
+            if summary_name == name:
+                lines.append(f'{_PREFIX}{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{_PREFIX}{name}_count{_format_labels(labels)} {count}')
+        lines.append(f'# TYPE {_PREFIX}{name}_last gauge')
+        lines.extend(f'{_PREFIX}{name}_last{_format_labels(labels)} {_format_value(last)}'
+                     for (summary_name, labels), (_, _, last) in summaries if summary_name == name)
+    return '\n'.join(lines) + '\n'
+
+
+def publish() -> None:
+    with _lock:
+        counters = sorted(_counters.items())
+    _log_structured({'event': 'metrics'} | {_flat_name(name, labels): value for (name, labels), value in counters})
+    filename = _METRICS_CONFIG.get('PROMETHEUS_FILE', None)
+    if filename:
+        _write_prometheus_file(pathlib.Path(__file__).parent / filename)
+
+
+def start_http_server() -> Optional[ThreadingHTTPServer]:
+    port = _METRICS_CONFIG.get('HTTP_PORT', None)
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('', int(port)), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f'Metrics served on port {port}')
+    return server
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = export_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _write_prometheus_file(filename: pathlib.Path) -> None:
+    # written to a temporary file first so that scrapers never see a partial file
+    os.makedirs(filename.parent, exist_ok=True)
+    tmp_filename = filename.with_suffix(filename.suffix + '.tmp')
+    with open(tmp_filename, 'w') as f:
+        f.write(export_prometheus())
+    os.replace(tmp_filename, filename)
+
+
+def _log_structured(record: dict) -> None:
+    if _METRICS_CONFIG.get('STRUCTURED_LOGS', True):
+        logging.info(json.dumps(record))
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    formatted = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return f'{{{formatted}}}'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _flat_name(name: str, labels: tuple) -> str:
+    return '.'.join([name] + [str(value) for _, value in labels])
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field
 from enum import Enum
+from typing import NamedTuple
 
 
 class RecipeType(str, Enum):
@@ -34,3 +35,48 @@ class Item:
     recipes: list[Recipe] = field(default_factory=list)
     crafting_fame: int = 0
     item_value: int = 0
+
+
+# plain records produced by the calculator, mapped to rows of ingredient_details, profit_details and
+# calculations_updates only when saved, ORM objects are left to the web app
+class IngredientDetailsRecord(NamedTuple):
+    item_name: str
+    item_id: str
+    quantity: int
+    local_price: float
+    total_cost: float
+    total_cost_with_transport: float
+    total_cost_with_returns: float
+    source_city: str
+
+
+class ProfitDetailsRecord(NamedTuple):
+    product_id: str
+    product_name: str
+    product_subcategory: str
+    product_subcategory_id: str
+    product_tier: str
+    product_quantity: int
+    recipe_type: RecipeType
+    final_product_price: float
+    ingredients_total_cost: float
+    profit_without_journals: float
+    profit_per_journal: float
+    journals_filled: float
+    profit_with_journals: float
+    profit_percentage: float
+    # items sold during the last 24h in the destination city and profit of selling that many
+    sellable_volume: float
+    daily_profit: float
+    destination_city: str
+    production_city: str
+    ingredients_details: list[IngredientDetailsRecord]
+
+    def to_dict(self) -> dict:
+        return {**self._asdict(),
+                'ingredients_details': [ingredient._asdict() for ingredient in self.ingredients_details]}
+
+
+class CalculationsUpdateRecord(NamedTuple):
+    type_key: str
+    profit_details: list[ProfitDetailsRecord]
@@ -1,8 +1,9 @@
 import logging
+import time
 
 import requests as requests
 
-from albion_calculator_backend import config
+from albion_calculator_backend import config, metrics
 
 _API_ADDRESS = config.CONFIG['DATA_PROJECT']['API_ADDRESS'] + '/{type}/{items}.json'
 _REQUEST_PARAMS = config.get_api_params()
@@ -12,14 +13,18 @@ def get_prices(items_ids: list[str]) -> tuple[list, list]:
     items_parameter = ','.join(items_ids)
     history_url = _API_ADDRESS.format(type='history', items=items_parameter)
     prices_url = _API_ADDRESS.format(type='prices', items=items_parameter)
-    history_prices = _get_json_from_url(history_url)
-    latest_prices = _get_json_from_url(prices_url)
+    history_prices = _get_json_from_url(history_url, 'history')
+    latest_prices = _get_json_from_url(prices_url, 'prices')
 
     return history_prices, latest_prices
 
 
-def _get_json_from_url(url: str) -> list[dict]:
+def _get_json_from_url(url: str, endpoint: str) -> list[dict]:
+    start = time.perf_counter()
     response = requests.get(url, params=_REQUEST_PARAMS)
+    metrics.observe('price_api_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+    metrics.increment('price_api_response_bytes', len(response.content), endpoint=endpoint)
+    metrics.increment('price_api_requests', endpoint=endpoint, status=str(response.status_code))
     if not response.ok:
         logging.error(f'{response.status_code} {response.text}')
         return []
@@ -5,7 +5,9 @@ import pathlib
 from datetime import datetime, timedelta
 from typing import Optional
 
-_CACHE_LIFETIME = 6
+from albion_calculator_backend import config
+
+_CACHE_LIFETIME = timedelta(minutes=config.CONFIG['DATA_PROJECT'].get('PRICE_CACHE_MINUTES', 360))
 _CACHE_FILENAME = pathlib.Path(__file__).parent / 'cache/price.cache'
 
 
@@ -44,5 +46,4 @@ def _is_cache_up_to_date() -> bool:
     modification_time = datetime.fromtimestamp(file_metadata.stat().st_mtime)
     current_time = datetime.now()
     elapsed_time = current_time - modification_time
-    hours_passed = elapsed_time // timedelta(hours=1)
-    return hours_passed < _CACHE_LIFETIME
+    return elapsed_time < _CACHE_LIFETIME
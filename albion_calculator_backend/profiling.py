@@ -0,0 +1,146 @@
+import cProfile
+import io
+import logging
+import os
+import pathlib
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Generator
+
+from albion_calculator_backend import config
+
+_PROFILING_CONFIG = config.CONFIG['APP'].get('PROFILING', {})
+
+_MODE = os.environ.get('ALBION_PROFILING_MODE', _PROFILING_CONFIG.get('MODE', None))
+_TARGET = os.environ.get('ALBION_PROFILING_TARGET', _PROFILING_CONFIG.get('TARGET', 'update_calculations'))
+_TRACEMALLOC = os.environ.get('ALBION_PROFILING_TRACEMALLOC',
+                              str(_PROFILING_CONFIG.get('TRACEMALLOC', False))).lower() in ('1', 'true', 'yes')
+_OUTPUT_DIR = pathlib.Path(__file__).parent / _PROFILING_CONFIG.get('OUTPUT_DIR', 'cache/profiles')
+_TOP_N = int(_PROFILING_CONFIG.get('TOP_N', 30))
+_SAMPLING_INTERVAL = float(_PROFILING_CONFIG.get('SAMPLING_INTERVAL', 0.005))
+
+
+@contextmanager
+def profile(target: str) -> Generator:
+    # target is either 'update_calculations' or a calculation key e.g. 'CRAFTING_TRAVEL_NO_FOCUS'
+    if not _MODE or target != _TARGET:
+        yield
+        return
+    if _MODE == 'cprofile':
+        with _cprofile(target):
+            yield
+    elif _MODE == 'sampling':
+        with _sampling_profile(target):
+            yield
+    else:
+        logging.error(f'Unknown profiling mode {_MODE}')
+        yield
+
+
+@contextmanager
+def trace_allocations(target: str) -> Generator:
+    if not _TRACEMALLOC:
+        yield
+        return
+    tracemalloc.start(_PROFILING_CONFIG.get('TRACEMALLOC_FRAMES', 10))
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        filename = _output_filename(target, 'tracemalloc')
+        snapshot.dump(str(filename))
+        top_lines = '\n'.join(str(stat) for stat in snapshot.statistics('lineno')[:_TOP_N])
+        _log_summary(f'Allocations in {target}: current {current // 1024} KiB, peak {peak // 1024} KiB, '
+                     f'snapshot saved to {filename}\n{top_lines}')
+
+
+@contextmanager
+def _cprofile(target: str) -> Generator:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        filename = _output_filename(target, 'prof')
+        profiler.dump_stats(filename)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(_TOP_N)
+        _log_summary(f'Profile of {target} saved to {filename}\n{summary.getvalue()}')
+
+
+@contextmanager
+def _sampling_profile(target: str) -> Generator:
+    sampler = _StackSampler(threading.get_ident(), _SAMPLING_INTERVAL)
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        filename = _output_filename(target, 'folded')
+        sampler.write_folded(filename)
+        _log_summary(f'Sampling profile of {target} ({sampler.samples_count} samples) saved to {filename}\n'
+                     f'{sampler.summary(_TOP_N)}')
+
+
+class _StackSampler(threading.Thread):
+    # periodically captures the stack of the profiled thread, output is compatible with flamegraph.pl
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples_count = 0
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({pathlib.Path(code.co_filename).name}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples_count += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+    def write_folded(self, filename: pathlib.Path) -> None:
+        with open(filename, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{";".join(stack)} {count}\n')
+
+    def summary(self, top_n: int) -> str:
+        own_samples = Counter()
+        total_samples = Counter()
+        for stack, count in self.stacks.items():
+            own_samples[stack[-1]] += count
+            for function in set(stack):
+                total_samples[function] += count
+        total = max(self.samples_count, 1)
+        lines = [f'{"own %":>7} {"total %":>7}  function']
+        lines.extend(f'{own_samples[function] / total:>7.1%} {total_samples[function] / total:>7.1%}  {function}'
+                     for function, _ in own_samples.most_common(top_n))
+        return '\n'.join(lines)
+
+
+def _output_filename(target: str, extension: str) -> pathlib.Path:
+    os.makedirs(_OUTPUT_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return _OUTPUT_DIR / f'{target}_{timestamp}.{extension}'
+
+
+def _log_summary(summary: str) -> None:
+    logging.info(summary)
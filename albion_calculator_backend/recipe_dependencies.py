@@ -0,0 +1,68 @@
+import logging
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+
+from albion_calculator_backend import items, journals, market, config
+from albion_calculator_backend.models import Recipe, RecipeType
+
+_DELTA_TOLERANCE = config.CONFIG['APP']['CALCULATOR'].get('DELTA_TOLERANCE', 0.01)
+
+# prices and sales volumes of items as they were when recipes depending on them were calculated for the last time,
+# volumes matter too - they limit sellable volumes and daily profits
+_calculated_prices = {}
+_calculated_volumes = {}
+
+
+def find_affected_recipes() -> tuple[list[str], list[Recipe]]:
+    changed_items = _find_changed_items()
+    affected_recipes = {id(recipe): recipe for item_id in changed_items
+                        for recipe in _dependent_recipes.get(item_id, [])}
+    logging.info(f'{len(changed_items)} items changed prices or volumes, {len(affected_recipes)} recipes affected')
+    return changed_items, list(affected_recipes.values())
+
+
+def remember_calculated_prices(items_ids: Optional[list[str]] = None) -> None:
+    items_ids = items.get_all_items_ids() if items_ids is None else items_ids
+    for item_id in items_ids:
+        _calculated_prices[item_id] = market.get_prices_for_item(item_id).copy()
+        _calculated_volumes[item_id] = market.get_sales_volumes_for_item(item_id).copy()
+
+
+def _find_changed_items() -> list[str]:
+    items_ids = items.get_all_items_ids()
+    current_prices = np.array([market.get_prices_for_item(item_id) for item_id in items_ids])
+    previous_prices = np.array([_calculated_prices.get(item_id, current_prices[index])
+                                for index, item_id in enumerate(items_ids)])
+    current_volumes = np.array([market.get_sales_volumes_for_item(item_id) for item_id in items_ids])
+    previous_volumes = np.array([_calculated_volumes.get(item_id, current_volumes[index])
+                                 for index, item_id in enumerate(items_ids)])
+    never_calculated = np.array([item_id not in _calculated_prices for item_id in items_ids])
+    missing_changed = np.isnan(current_prices) != np.isnan(previous_prices)
+    with np.errstate(invalid='ignore'):
+        price_changed = _changed_beyond_tolerance(current_prices, previous_prices)
+    # a volume appearing where nothing was sold is a change too
+    volume_changed = _changed_beyond_tolerance(current_volumes, previous_volumes)
+    changed = never_calculated | (missing_changed | price_changed | volume_changed).any(axis=1)
+    return [item_id for item_id, is_changed in zip(items_ids, changed) if is_changed]
+
+
+def _changed_beyond_tolerance(current: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    return np.abs(current - previous) > _DELTA_TOLERANCE * np.abs(previous)
+
+
+def _build_dependency_index() -> dict[str, list[Recipe]]:
+    dependent_recipes = defaultdict(list)
+    recipes = items.get_all_crafting_recipes() + items.get_all_upgrade_recipes() + items.get_all_transport_recipes()
+    for recipe in recipes:
+        dependencies = {recipe.result_item_id} | {ingredient.item_id for ingredient in recipe.ingredients}
+        journal = journals.get_journal_for_item(recipe.result_item_id)
+        if recipe.recipe_type == RecipeType.CRAFTING and journal is not None:
+            dependencies.add(journal['item_id'] + '_FULL')
+        for item_id in dependencies:
+            dependent_recipes[item_id].append(recipe)
+    return dependent_recipes
+
+
+_dependent_recipes = _build_dependency_index()
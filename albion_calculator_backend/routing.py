@@ -0,0 +1,72 @@
+import functools
+from math import nan, inf
+from typing import Union
+
+import numpy as np
+from numpy import ndarray
+
+from albion_calculator_backend import config
+
+# (name, is_risky) for every city and (city, city, tiles) for every direct route
+_CITY_GRAPH = (tuple((city['NAME'], bool(city.get('RISKY', False))) for city in config.CONFIG['CITIES']),
+               tuple((route[0], route[1], int(route[2])) for route in config.CONFIG['ROUTES']))
+
+
+def get_multipliers(one_tile: float, dtype: type = np.float64) -> dict[str, Union[ndarray, list[ndarray]]]:
+    return _build_multipliers(one_tile, _CITY_GRAPH, np.dtype(dtype))
+
+
+def get_tiles_matrix(avoid_risky: bool = False) -> ndarray:
+    return _shortest_paths(_CITY_GRAPH, avoid_risky)
+
+
+# travel costs of custom calculations are given by users, only as many as custom results are kept
+@functools.lru_cache(maxsize=config.CONFIG['APP']['CALCULATOR'].get('CUSTOM_CALCULATIONS_CACHE_SIZE', 32))
+def _build_multipliers(one_tile: float, city_graph: tuple,
+                       dtype: np.dtype) -> dict[str, Union[ndarray, list[ndarray]]]:
+    # MATRIX[transport_to][transport_from]
+    cities_count = len(city_graph[0])
+    multipliers = {'TRAVEL': _tiles_to_multiplier(_shortest_paths(city_graph, avoid_risky=False), one_tile, dtype),
+                   'NO_RISK': _tiles_to_multiplier(_shortest_paths(city_graph, avoid_risky=True), one_tile, dtype),
+                   'NO_TRAVEL': _one_city_multiplier(cities_count, range(cities_count), dtype),
+                   'PER_CITY': [_one_city_multiplier(cities_count, [city_index], dtype)
+                                for city_index in range(cities_count)]}
+    # cached matrices are shared between all callers
+    for multiplier in [multipliers['TRAVEL'], multipliers['NO_RISK'], multipliers['NO_TRAVEL'],
+                       *multipliers['PER_CITY']]:
+        multiplier.setflags(write=False)
+    return multipliers
+
+
+@functools.lru_cache(maxsize=None)
+def _shortest_paths(city_graph: tuple, avoid_risky: bool) -> ndarray:
+    cities, routes = city_graph
+    index = {name: i for i, (name, _) in enumerate(cities)}
+    risky = np.array([is_risky for _, is_risky in cities])
+    tiles = np.full((len(cities), len(cities)), inf)
+    np.fill_diagonal(tiles, 0)
+    for city_from, city_to, route_tiles in routes:
+        if avoid_risky and (risky[index[city_from]] or risky[index[city_to]]):
+            continue
+        tiles[index[city_from], index[city_to]] = min(tiles[index[city_from], index[city_to]], route_tiles)
+        tiles[index[city_to], index[city_from]] = tiles[index[city_from], index[city_to]]
+    # Floyd-Warshall, vectorized over all pairs for every intermediate city
+    for k in range(len(cities)):
+        tiles = np.minimum(tiles, tiles[:, k, np.newaxis] + tiles[np.newaxis, k, :])
+    tiles.setflags(write=False)
+    return tiles
+
+
+def _tiles_to_multiplier(tiles: ndarray, one_tile: float, dtype: np.dtype) -> ndarray:
+    # computed in float64, only the result has the requested precision
+    with np.errstate(over='ignore'):
+        multiplier = np.power(one_tile, tiles)
+    multiplier[np.isinf(tiles)] = nan
+    return multiplier.astype(dtype)
+
+
+def _one_city_multiplier(cities_count: int, city_indexes, dtype: np.dtype) -> ndarray:
+    multiplier = np.full((cities_count, cities_count), nan, dtype=dtype)
+    for city_index in city_indexes:
+        multiplier[city_index][city_index] = 1.0
+    return multiplier
@@ -0,0 +1,93 @@
+import json
+import os
+import pathlib
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+from numpy import ndarray
+
+from albion_calculator_backend import config
+
+_SHARED_PRICES_CONFIG = config.CONFIG['APP'].get('SHARED_PRICES', {})
+
+_DIRECTORY = pathlib.Path(__file__).parent / _SHARED_PRICES_CONFIG.get('DIRECTORY', 'cache/shared_prices')
+_INDEX_FILE = _DIRECTORY / 'index.json'
+_KEPT_MATRICES = 2
+_PRICES, _SALES_VOLUMES = 0, 1
+
+
+class SharedPrices(NamedTuple):
+    version: int
+    index_mtime: int
+    items_indexes: dict[str, int]
+    # read-only memory map, pages are shared by all processes mapping the same file;
+    # matrix[item_index] holds prices and sales volumes in every city
+    matrix: ndarray
+
+    def prices_by_item(self) -> dict[str, ndarray]:
+        return {item_id: self.matrix[index, _PRICES] for item_id, index in self.items_indexes.items()}
+
+    def sales_volumes_by_item(self) -> dict[str, ndarray]:
+        return {item_id: self.matrix[index, _SALES_VOLUMES] for item_id, index in self.items_indexes.items()}
+
+
+def publish(prices: dict[str, ndarray], sales_volumes: dict[str, ndarray]) -> None:
+    # a new matrix file for every version, readers keep the old one mapped until they switch
+    os.makedirs(_DIRECTORY, exist_ok=True)
+    items_ids = sorted(prices)
+    version = time.time_ns()
+    matrix_filename = f'prices_{version}.npy'
+    temporary_file = _DIRECTORY / f'{matrix_filename}.tmp'
+    cities_count = len(prices[items_ids[0]]) if items_ids else 0
+    dtype = prices[items_ids[0]].dtype if items_ids else np.float64
+    matrix = np.lib.format.open_memmap(temporary_file, mode='w+', dtype=dtype,
+                                       shape=(len(items_ids), 2, cities_count))
+    for index, item_id in enumerate(items_ids):
+        matrix[index, _PRICES] = prices[item_id]
+        matrix[index, _SALES_VOLUMES] = sales_volumes.get(item_id, 0)
+    matrix.flush()
+    del matrix
+    os.replace(temporary_file, _DIRECTORY / matrix_filename)
+    _write_index({'version': version, 'matrix': matrix_filename, 'items_ids': items_ids})
+    _remove_old_matrices()
+
+
+def load_if_changed(current: Optional[SharedPrices]) -> Optional[SharedPrices]:
+    # returns None when nothing is published or the published version is the current one
+    try:
+        index_mtime = _INDEX_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if current is not None and current.index_mtime == index_mtime:
+        return None
+    with open(_INDEX_FILE) as f:
+        index = json.load(f)
+    if current is not None and current.version == index['version']:
+        return None
+    try:
+        matrix = np.load(_DIRECTORY / index['matrix'], mmap_mode='r')
+    except FileNotFoundError:
+        # removed by newer publishes since the index was read, the next call reads the new index
+        return None
+    if matrix.ndim != 3:
+        # published by an older version without sales volumes, ignored until the worker publishes again
+        return None
+    return SharedPrices(version=index['version'],
+                        index_mtime=index_mtime,
+                        items_indexes={item_id: i for i, item_id in enumerate(index['items_ids'])},
+                        matrix=matrix)
+
+
+def _write_index(index: dict) -> None:
+    temporary_file = _INDEX_FILE.with_suffix(f'.{index["version"]}.tmp')
+    with open(temporary_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(temporary_file, _INDEX_FILE)
+
+
+def _remove_old_matrices() -> None:
+    # unlinking is safe on POSIX, processes which still map a removed file keep reading it
+    matrices = sorted(_DIRECTORY.glob('prices_*.npy'), key=lambda path: int(path.stem.split('_')[1]))
+    for path in matrices[:-_KEPT_MATRICES]:
+        path.unlink(missing_ok=True)
@@ -0,0 +1,176 @@
+import fcntl
+import json
+import logging
+import os
+import pathlib
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Generator
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.blocking import BlockingScheduler
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from albion_calculator_backend import calculator, config, metrics, database
+from albion_calculator_backend.database import engine
+
+_WORKER_CONFIG = config.CONFIG['APP']['WORKER']
+
+_PRICE_REFRESH_MINUTES = _WORKER_CONFIG.get('PRICE_REFRESH_MINUTES', 60)
+_FULL_RECOMPUTE_HOURS = _WORKER_CONFIG.get('FULL_RECOMPUTE_HOURS', [6, 18])
+_JITTER_SECONDS = _WORKER_CONFIG.get('JITTER_SECONDS', 0)
+_LOCK_NAME = _WORKER_CONFIG.get('LOCK_NAME', 'albion_calculator_worker')
+_LOCK_KEEPALIVE_SECONDS = _WORKER_CONFIG.get('LOCK_KEEPALIVE_SECONDS', 300)
+_LOCK_FILE = pathlib.Path(__file__).parent / _WORKER_CONFIG.get('LOCK_FILE', 'cache/worker.lock')
+_STATUS_FILE = pathlib.Path(__file__).parent / _WORKER_CONFIG.get('STATUS_FILE', 'cache/worker_status.json')
+
+PRICE_REFRESH = 'price_refresh'
+FULL_RECOMPUTE = 'full_recompute'
+
+
+def start_worker() -> None:
+    metrics.start_http_server()
+    # tables are upgraded by the worker which writes them, once for all workers started at the same time
+    with _exclusive_run() as acquired:
+        if acquired:
+            database.upgrade_db()
+    # a single thread runs the jobs so they never overlap within this process, the lock covers other processes
+    scheduler = BlockingScheduler(executors={'default': ThreadPoolExecutor(1)},
+                                  job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': None})
+    scheduler.add_job(run_calculations, 'interval', args=[PRICE_REFRESH], minutes=_PRICE_REFRESH_MINUTES,
+                      jitter=_JITTER_SECONDS, next_run_time=_find_first_price_refresh_time())
+    hours = _FULL_RECOMPUTE_HOURS if isinstance(_FULL_RECOMPUTE_HOURS, list) else [_FULL_RECOMPUTE_HOURS]
+    scheduler.add_job(run_calculations, 'cron', args=[FULL_RECOMPUTE], hour=','.join(str(hour) for hour in hours),
+                      jitter=_JITTER_SECONDS)
+
+    def shutdown(signum, frame) -> None:
+        logging.info(f'Signal {signum} received, stopping the worker')
+        calculator.request_stop()
+        scheduler.shutdown(wait=True)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    scheduler.start()
+
+
+def run_calculations(run_type: str) -> None:
+    with _exclusive_run() as acquired:
+        if not acquired:
+            logging.warning(f'Skipping {run_type}, calculations are already running in another process')
+            metrics.increment('worker_runs_skipped', run_type=run_type)
+            return
+        start = time.perf_counter()
+        try:
+            calculator.update_calculations(full_recalculation=run_type == FULL_RECOMPUTE)
+            status = 'success'
+        except calculator.CalculationsInterrupted:
+            status = 'interrupted'
+        except Exception:
+            logging.exception(f'{run_type} failed')
+            status = 'failed'
+        seconds = round(time.perf_counter() - start, 3)
+        logging.info(f'{run_type} finished with status {status} in {seconds}s')
+        metrics.increment('worker_runs', run_type=run_type, status=status)
+        _save_status(run_type, status, seconds)
+
+
+def load_status() -> dict:
+    if not _STATUS_FILE.exists():
+        return {}
+    with open(_STATUS_FILE) as f:
+        return json.load(f)
+
+
+def _save_status(run_type: str, status: str, seconds: float) -> None:
+    statuses = load_status()
+    finished = datetime.now().isoformat(timespec='seconds')
+    last_success = finished if status == 'success' else statuses.get(run_type, {}).get('last_success', None)
+    statuses[run_type] = {'status': status, 'finished': finished, 'seconds': seconds, 'last_success': last_success}
+    os.makedirs(_STATUS_FILE.parent, exist_ok=True)
+    temporary_file = _STATUS_FILE.with_suffix('.tmp')
+    with open(temporary_file, 'w') as f:
+        json.dump(statuses, f, indent=1)
+    os.replace(temporary_file, _STATUS_FILE)
+
+
+def _find_first_price_refresh_time() -> datetime:
+    # both runs refresh prices, so a restart shortly after any successful one waits for the regular cadence
+    statuses = load_status()
+    last_successes = [datetime.fromisoformat(statuses[run_type]['last_success'])
+                      for run_type in (PRICE_REFRESH, FULL_RECOMPUTE)
+                      if statuses.get(run_type, {}).get('last_success', None)]
+    if not last_successes:
+        return datetime.now()
+    return max(datetime.now(), max(last_successes) + timedelta(minutes=_PRICE_REFRESH_MINUTES))
+
+
+@contextmanager
+def _exclusive_run() -> Generator[bool, None, None]:
+    # advisory locks are held by the database connection, other databases (e.g. SQLite) use a lock file
+    dialect = engine.dialect.name
+    if dialect == 'mysql':
+        with _database_lock('SELECT GET_LOCK(:name, 0)', 'SELECT RELEASE_LOCK(:name)', _LOCK_NAME) as acquired:
+            yield acquired
+    elif dialect == 'postgresql':
+        with _database_lock('SELECT pg_try_advisory_lock(hashtext(:name))',
+                            'SELECT pg_advisory_unlock(hashtext(:name))', _LOCK_NAME) as acquired:
+            yield acquired
+    else:
+        with _file_lock(_LOCK_FILE) as acquired:
+            yield acquired
+
+
+@contextmanager
+def _database_lock(lock_statement: str, unlock_statement: str, name: str) -> Generator[bool, None, None]:
+    # the lock is released with its connection, which is kept busy during the run so the server doesn't close it
+    # as idle (wait_timeout on MySQL)
+    with engine.connect() as connection:
+        acquired = bool(connection.execute(text(lock_statement), {'name': name}).scalar())
+        stop_keepalive = threading.Event()
+        keepalive = threading.Thread(target=_keep_connection_alive, args=(connection, stop_keepalive), daemon=True)
+        if acquired:
+            keepalive.start()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                stop_keepalive.set()
+                keepalive.join()
+                try:
+                    connection.execute(text(unlock_statement), {'name': name})
+                except SQLAlchemyError:
+                    # the connection isn't returned to the pool, closing it releases the lock if it's still held
+                    logging.warning('Worker lock could not be released, closing its connection', exc_info=True)
+                    connection.invalidate()
+
+
+def _keep_connection_alive(connection, stop: threading.Event) -> None:
+    while not stop.wait(_LOCK_KEEPALIVE_SECONDS):
+        try:
+            connection.execute(text('SELECT 1'))
+        except SQLAlchemyError:
+            logging.exception('Connection holding the worker lock was lost, another worker may start calculations')
+            return
+
+
+@contextmanager
+def _file_lock(filename: pathlib.Path) -> Generator[bool, None, None]:
+    os.makedirs(filename.parent, exist_ok=True)
+    with open(filename, 'w') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+if __name__ == '__main__':
+    start_worker()
@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Generator, Optional
+
+import numpy as np
+
+_DEFAULT_SIZES = [1000, 10000, 50000]
+_VARIANTS = [('TRANSPORT', 'TRAVEL', False), ('TRANSPORT', 'NO_RISK', False),
+             ('CRAFTING', 'PER_CITY', True), ('CRAFTING', 'PER_CITY', False),
+             ('CRAFTING', 'NO_TRAVEL', True), ('CRAFTING', 'NO_TRAVEL', False),
+             ('CRAFTING', 'TRAVEL', True), ('CRAFTING', 'TRAVEL', False),
+             ('CRAFTING', 'NO_RISK', True), ('CRAFTING', 'NO_RISK', False),
+             ('UPGRADE', 'PER_CITY', False), ('UPGRADE', 'NO_TRAVEL', False),
+             ('UPGRADE', 'TRAVEL', False), ('UPGRADE', 'NO_RISK', False),
+             ('CHAIN', 'NO_TRAVEL', True), ('CHAIN', 'NO_TRAVEL', False),
+             ('CHAIN', 'TRAVEL', True), ('CHAIN', 'TRAVEL', False),
+             ('CHAIN', 'NO_RISK', True), ('CHAIN', 'NO_RISK', False)]
+_TIERS = range(4, 9)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the calculations refresh pipeline on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=_DEFAULT_SIZES,
+                        help='numbers of crafting recipes to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', default=None,
+                        help='SQLite file used for persistence stage, temporary file by default')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='trace python allocations per stage (slows down the run)')
+    parser.add_argument('--output', default=None, help='write JSON report to file instead of stdout')
+    return parser.parse_args()
+
+
+def _configure_database(database_path: Optional[str]) -> str:
+    database_path = database_path or os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{database_path}'
+    return database_path
+
+
+class _StageTimer:
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str, units: int) -> Generator:
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._record(name, units, elapsed)
+
+    def _record(self, name: str, units: int, elapsed: float) -> None:
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'units': 0})
+        stage['seconds'] = round(stage['seconds'] + elapsed, 6)
+        stage['units'] += units
+        stage['units_per_second'] = round(stage['units'] / stage['seconds'], 1) if stage['seconds'] else None
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stage['peak_traced_kb'] = max(stage.get('peak_traced_kb', 0), peak // 1024)
+        stage['peak_rss_kb'] = _peak_rss_kb()
+
+
+def _peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _generate_catalogue(recipes_count: int, rng: np.random.Generator) -> dict:
+    from albion_calculator_backend import crafting_modifiers
+    from albion_calculator_backend.models import Recipe, RecipeType, Ingredient
+
+    subcategories = crafting_modifiers.get_craftable_categories()
+    materials_count = max(50, recipes_count // 5)
+    catalogue = {}
+    materials = []
+    for i in range(materials_count):
+        item_id = f'T{rng.choice(_TIERS)}_BENCH_MATERIAL_{i}'
+        materials.append(item_id)
+        catalogue[item_id] = _create_item(item_id, 'resources', 'metalbar')
+    for tier in _TIERS:
+        journal_id = f'T{tier}_BENCH_JOURNAL_FULL'
+        catalogue[journal_id] = _create_item(journal_id, 'other', 'journal')
+    for i in range(recipes_count):
+        item_id = f'T{rng.choice(_TIERS)}_BENCH_PRODUCT_{i}'
+        ingredients = [Ingredient(material, int(rng.integers(1, 33)), float(rng.choice([0, np.inf])))
+                       for material in rng.choice(materials, size=rng.integers(2, 5), replace=False)]
+        recipe = Recipe(item_id, RecipeType.CRAFTING, int(rng.choice([1, 1, 1, 5, 10])),
+                        int(rng.integers(0, 500)), ingredients)
+        subcategory = str(rng.choice(subcategories))
+        catalogue[item_id] = _create_item(item_id, 'melee', subcategory, recipes=[recipe],
+                                          crafting_fame=int(rng.integers(100, 5000)))
+        if i % 4 == 0:
+            upgraded_id = item_id + '@1'
+            upgrade_ingredients = [Ingredient(str(rng.choice(materials)), int(rng.integers(10, 97)), np.inf),
+                                   Ingredient(item_id, 1, np.inf)]
+            upgrade_recipe = Recipe(upgraded_id, RecipeType.UPGRADE, ingredients=upgrade_ingredients)
+            catalogue[upgraded_id] = _create_item(upgraded_id, 'melee', subcategory, base_item_id=item_id,
+                                                  recipes=[upgrade_recipe])
+    return catalogue
+
+
+def _create_item(item_id: str, category: str, subcategory: str, base_item_id: Optional[str] = None,
+                 recipes: Optional[list] = None, crafting_fame: int = 0):
+    from albion_calculator_backend.models import Item, Recipe, RecipeType, Ingredient
+    transport_recipe = Recipe(item_id, RecipeType.TRANSPORT, ingredients=[Ingredient(item_id, 1, 0)])
+    return Item(item_id, item_id, category, subcategory, base_item_id, (recipes or []) + [transport_recipe],
+                crafting_fame)
+
+
+def _install_catalogue(catalogue: dict) -> None:
+    from albion_calculator_backend import items, journals, crafting_chain, item_metadata
+    from albion_calculator_backend.models import RecipeType
+
+    items._items_data = catalogue
+    items._recipes = items._load_recipes()
+    items._crafting_recipes = [recipe for recipe in items._recipes if recipe.recipe_type == RecipeType.CRAFTING]
+    items._upgrade_recipes = [recipe for recipe in items._recipes if recipe.recipe_type == RecipeType.UPGRADE]
+    items._transport_recipes = [recipe for recipe in items._recipes if recipe.recipe_type == RecipeType.TRANSPORT]
+    journals._journals_grouped_by_valid_item = {
+        item_id: {'max_fame': 900 * 2 ** int(item_id[1]), 'cost': 100 * int(item_id[1]), 'valid_items': [],
+                  'item_id': f'T{item_id[1]}_BENCH_JOURNAL'}
+        for item_id in catalogue if '_BENCH_PRODUCT_' in item_id}
+    crafting_chain._production_recipes = crafting_chain._load_production_recipes()
+    crafting_chain._production_order = crafting_chain._find_production_order()
+    item_metadata._items_indexes, item_metadata._metadata_table = item_metadata._build_metadata_table()
+    journals._journal_table = journals._build_journal_table()
+
+
+def _synthetic_price_api(items_ids: list[str], rng: np.random.Generator) -> callable:
+    # payloads are generated upfront so that only ingestion is measured in the download stage
+    from albion_calculator_backend.cities import cities_names
+
+    date = datetime(2021, 7, 1)
+    dates = [(date - timedelta(hours=6 * i)).strftime('%Y-%m-%dT%H:%M:%S') for i in range(8)]
+    history_prices, latest_prices = {}, {}
+    for item_id in items_ids:
+        base_price = float(rng.integers(100, 100000))
+        history_prices[item_id], latest_prices[item_id] = [], []
+        for city in cities_names():
+            if rng.random() < 0.1:
+                continue
+            city_price = base_price * rng.uniform(0.8, 1.2)
+            data = [{'item_count': int(rng.integers(0, 50)),
+                     'avg_price': round(city_price * rng.uniform(0.9, 1.1)),
+                     'timestamp': timestamp} for timestamp in dates]
+            history_prices[item_id].append({'item_id': item_id, 'location': city, 'quality': 1, 'data': data})
+            latest_prices[item_id].append({'item_id': item_id, 'city': city, 'quality': 1,
+                                           'sell_price_min': int(city_price), 'sell_price_min_date': dates[0],
+                                           'sell_price_max': int(city_price * 1.1), 'sell_price_max_date': dates[0],
+                                           'buy_price_min': int(city_price * 0.8), 'buy_price_min_date': dates[0],
+                                           'buy_price_max': int(city_price * 0.9), 'buy_price_max_date': dates[0]})
+
+    def get_prices(chunk: list[str]) -> tuple[list, list]:
+        return ([record for item_id in chunk for record in history_prices[item_id]],
+                [record for item_id in chunk for record in latest_prices[item_id]])
+
+    return get_prices
+
+
+def _install_synthetic_prices(items_ids: list[str], rng: np.random.Generator,
+                              timer: Optional[_StageTimer] = None) -> None:
+    # prices and sales volumes of a synthetic market, estimated like market.update_prices does without fetching
+    from albion_calculator_backend import market
+
+    timer = timer or _StageTimer(trace_memory=False)
+    market.get_prices = _synthetic_price_api(items_ids, rng)
+    with timer.stage('load_all_prices', len(items_ids)):
+        market._items_prices = market._load_all_prices.__wrapped__(items_ids)
+    with timer.stage('estimate_real_prices', len(items_ids)):
+        estimated_prices = {item_id: market._estimate_real_prices_for_item(item_id) for item_id in items_ids}
+        market._sales_volumes = {item_id: market._estimate_sales_volumes_for_item(item_id) for item_id in items_ids}
+    with timer.stage('correct_erroneous_prices', len(items_ids)):
+        market._estimated_real_prices = market._correct_erroneous_prices(estimated_prices)
+    market._price_generation += 1
+
+
+def _run_benchmark(recipes_count: int, seed: int, trace_memory: bool) -> dict:
+    from albion_calculator_backend import calculator, calculations_reader, database, items
+    from albion_calculator_backend.database import BackendSession
+
+    rng = np.random.default_rng(seed)
+    timer = _StageTimer(trace_memory)
+    calculator._latest_results.clear()
+    with timer.stage('generate_catalogue', recipes_count):
+        _install_catalogue(_generate_catalogue(recipes_count, rng))
+    items_ids = items.get_all_items_ids()
+    _install_synthetic_prices(items_ids, rng, timer)
+
+    recipes_by_type = {'TRANSPORT': items.get_all_transport_recipes(),
+                       'CRAFTING': items.get_all_crafting_recipes(),
+                       'CHAIN': items.get_all_crafting_recipes(),
+                       'UPGRADE': items.get_all_upgrade_recipes()}
+    calculations_updates = []
+    for recipe_type, limitation, use_focus in _VARIANTS:
+        recipes = recipes_by_type[recipe_type]
+        key = calculations_reader.create_calculation_key(limitation, recipe_type, use_focus)
+        with timer.stage(f'calculate_profits.{key}', len(recipes)):
+            calculations_updates.extend(calculator._calculate_profits(recipe_type, limitation, recipes, use_focus))
+
+    database.drop_db()
+    database.init_db()
+    rows_count = sum(len(update.profit_details) + sum(len(details.ingredients_details)
+                                                     for details in update.profit_details)
+                     for update in calculations_updates)
+    with BackendSession() as session, timer.stage('bulk_insert_calculations_update', rows_count):
+        for calculations_update in calculations_updates:
+            session.bulk_insert_calculations_update(calculations_update)
+
+    calculation_stages = [stage for name, stage in timer.stages.items() if name.startswith('calculate_profits.')]
+    return {'recipes': recipes_count,
+            'items': len(items_ids),
+            'crafting_recipes': len(recipes_by_type['CRAFTING']),
+            'upgrade_recipes': len(recipes_by_type['UPGRADE']),
+            'transport_recipes': len(recipes_by_type['TRANSPORT']),
+            'profit_details_rows': sum(len(update.profit_details) for update in calculations_updates),
+            'calculate_profits_seconds': round(sum(stage['seconds'] for stage in calculation_stages), 6),
+            'total_seconds': round(sum(stage['seconds'] for name, stage in timer.stages.items()
+                                       if name != 'generate_catalogue'), 6),
+            'peak_rss_kb': _peak_rss_kb(),
+            'stages': timer.stages}
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    args = _parse_args()
+    database_path = _configure_database(args.database)
+    report = {'revision': _git_revision(),
+              'timestamp': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'database': database_path,
+              'results': [_run_benchmark(size, args.seed, args.tracemalloc) for size in args.sizes]}
+    output = json.dumps(report, indent=1)
+    if args.output is None:
+        print(output)
+        return
+    with open(args.output, 'w') as f:
+        f.write(output)
+
+
+if __name__ == '__main__':
+    main()
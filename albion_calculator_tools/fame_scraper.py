@@ -1,4 +1,12 @@
+import argparse
 import json
+import logging
+import os
+import pathlib
+import re
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional
 
 import requests
@@ -6,9 +14,63 @@ from bs4 import BeautifulSoup
 
 import albion_calculator_backend.items_parser
 from albion_calculator_backend import items, crafting_modifiers
+from albion_calculator_tools import http_client
+
+try:
+    import lxml  # noqa: F401
+    _HTML_PARSER = 'lxml'
+except ImportError:
+    _HTML_PARSER = 'html.parser'
 
 URL = 'https://www.albiononline2d.com/en/item/id/'
 
+_FAME_LABEL = 'Crafting Fame (Premium)'
+# the cell right after the label, good enough for the page as it is, the full parser covers layout changes
+_FAME_ROW_PATTERN = re.compile(r'<td[^>]*>\s*' + re.escape(_FAME_LABEL) + r'\s*</td>\s*<td[^>]*>(.*?)</td>', re.S)
+_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+_CACHE_DIRECTORY = pathlib.Path(__file__).parent.parent / 'albion_calculator_backend/cache/fame_pages'
+# pages which don't exist are cached too, so they aren't requested on every run
+_NOT_FOUND_SUFFIX = '.404'
+# scraped fame is saved every this many items, an interrupted run keeps what it scraped
+_SAVE_INTERVAL = 100
+
+
+class _PageCache:
+    # raw pages on disk, parsing can be changed and rerun without fetching anything
+    def __init__(self, directory: pathlib.Path, max_age_days: float):
+        self.directory = directory
+        self.max_age_seconds = max_age_days * 24 * 3600
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def contains(self, item_id: str, fresh_only: bool = True) -> bool:
+        return any(path.exists() and (not fresh_only or self._is_fresh(path)) for path in self._paths(item_id))
+
+    def get(self, item_id: str) -> Optional[str]:
+        page_path, _ = self._paths(item_id)
+        if not page_path.exists():
+            return None
+        return page_path.read_text(encoding='utf8')
+
+    def put(self, item_id: str, page_content: str) -> None:
+        page_path, not_found_path = self._paths(item_id)
+        temporary_file = page_path.with_suffix(f'.{os.getpid()}.tmp')
+        temporary_file.write_text(page_content, encoding='utf8')
+        os.replace(temporary_file, page_path)
+        not_found_path.unlink(missing_ok=True)
+
+    def put_not_found(self, item_id: str) -> None:
+        page_path, not_found_path = self._paths(item_id)
+        not_found_path.touch()
+        page_path.unlink(missing_ok=True)
+
+    def _paths(self, item_id: str) -> tuple[pathlib.Path, pathlib.Path]:
+        name = urllib.parse.quote(item_id, safe='')
+        return self.directory / f'{name}.html', self.directory / f'{name}{_NOT_FOUND_SUFFIX}'
+
+    def _is_fresh(self, path: pathlib.Path) -> bool:
+        return self.max_age_seconds <= 0 or time.time() - path.stat().st_mtime < self.max_age_seconds
+
 
 # item_ids for enchanted refined resources are wrong so no fame for those but we don't care about them anyway
 # only needed for crafting items with journals
@@ -19,32 +81,113 @@ def _convert_text_to_int(amount_text: str) -> float:
     return int(amount_text)
 
 
-def _get_fame_for_item(item_id: str) -> Optional[int]:
-    page = requests.get(URL + item_id)
-    if not page:
+def _get_fame_for_item(page_content: str) -> Optional[int]:
+    amount_text = _extract_fame_text(page_content)
+    if amount_text is None:
         return None
-    soup = BeautifulSoup(page.content, 'html.parser')
-    cell_with_fame_label = soup.findAll('td', text='Crafting Fame (Premium)')
-    if not cell_with_fame_label:
-        return None
-    row = cell_with_fame_label[0].parent
-    amount_text = row.contents[1].text
     fame_with_premium = _convert_text_to_int(amount_text)
     fame_no_premium = fame_with_premium / 1.5
     return int(fame_no_premium)
 
 
-def _get_crafting_fame_for_items(*args: str) -> dict[str, float]:
-    return {item_id: _get_fame_for_item(item_id) for item_id in args}
+def _extract_fame_text(page_content: str) -> Optional[str]:
+    if _FAME_LABEL not in page_content:
+        return None
+    match = _FAME_ROW_PATTERN.search(page_content)
+    if match is not None:
+        return _TAG_PATTERN.sub('', match.group(1)).strip()
+    soup = BeautifulSoup(page_content, _HTML_PARSER)
+    cell_with_fame_label = soup.findAll('td', text=_FAME_LABEL)
+    if not cell_with_fame_label:
+        return None
+    return cell_with_fame_label[0].find_next_sibling('td').text.strip()
+
+
+def _get_crafting_fame_for_items(items_ids: list[str], cache: _PageCache, workers: int, offline: bool,
+                                 crafting_fame: dict[str, Optional[int]]) -> None:
+    # scraped values are merged into crafting_fame, which is saved along the way
+    if offline:
+        items_ids = [item_id for item_id in items_ids if cache.contains(item_id, fresh_only=False)]
+    session = http_client.create_session(workers)
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {executor.submit(_load_page, session, cache, item_id, offline): item_id for item_id in items_ids}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            item_id = futures[future]
+            try:
+                page_content = future.result()
+            except requests.RequestException as e:
+                logging.error(f'{item_id}: {e}')
+                continue
+            try:
+                crafting_fame[item_id] = _get_fame_for_item(page_content) if page_content is not None else None
+            except ValueError as e:
+                logging.error(f'{item_id}: fame could not be parsed, {e}')
+                crafting_fame[item_id] = None
+            if completed % _SAVE_INTERVAL == 0:
+                _save_crafting_fame_to_file(crafting_fame)
+                logging.info(f'{completed}/{len(items_ids)} items scraped')
+
+
+def _load_page(session: requests.Session, cache: _PageCache, item_id: str, offline: bool) -> Optional[str]:
+    if offline or cache.contains(item_id):
+        return cache.get(item_id)
+    response = http_client.get_with_retries(session, URL + item_id, retries=3, backoff=1, timeout=30)
+    if response.status_code == 404:
+        cache.put_not_found(item_id)
+        return None
+    response.raise_for_status()
+    # without a charset in headers requests would guess it from the whole page
+    response.encoding = response.encoding or 'utf-8'
+    cache.put(item_id, response.text)
+    return response.text
+
+
+def _load_crafting_fame_file() -> dict[str, Optional[int]]:
+    if not albion_calculator_backend.items_parser.CRAFTING_FAME_JSON_FILE.exists():
+        return {}
+    with open(albion_calculator_backend.items_parser.CRAFTING_FAME_JSON_FILE) as f:
+        return json.load(f)
 
 
 def _save_crafting_fame_to_file(content_dict: dict) -> None:
-    with open(albion_calculator_backend.items_parser.CRAFTING_FAME_JSON_FILE, 'w+') as f:
-        json.dump(content_dict, f)
+    filename = albion_calculator_backend.items_parser.CRAFTING_FAME_JSON_FILE
+    temporary_file = filename.with_suffix('.tmp')
+    with open(temporary_file, 'w+') as f:
+        json.dump(content_dict, f, indent=2)
+    os.replace(temporary_file, filename)
+
+
+def _select_items_to_scrape(items_ids: list[str], crafting_fame: dict[str, Optional[int]], refresh: bool,
+                            retry_missing: bool) -> list[str]:
+    if refresh:
+        return items_ids
+    return [item_id for item_id in items_ids
+            if item_id not in crafting_fame or (retry_missing and crafting_fame[item_id] is None)]
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Scrape crafting fame of craftable items into crafting_fame.json')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent requests')
+    parser.add_argument('--cache-dir', type=pathlib.Path, default=_CACHE_DIRECTORY,
+                        help='directory with cached pages, also used for saved HTML fixtures')
+    parser.add_argument('--cache-days', type=float, default=30, help='age of reused pages, 0 reuses them forever')
+    parser.add_argument('--offline', action='store_true', help='use cached pages only, never touch the network')
+    parser.add_argument('--refresh', action='store_true', help='scrape all items, not only the new ones')
+    parser.add_argument('--retry-missing', action='store_true', help='scrape again items without known fame')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
+    # the backend package configures debug logging on import, progress of the tool is enough here
+    logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p', level=logging.INFO,
+                        force=True)
+    args = _parse_args()
     craftable_subcategories = crafting_modifiers.get_craftable_categories()
-    items_ids = items.get_items_ids_for_category_or_subcategory(*craftable_subcategories)
-    crafting_fame_dict = _get_crafting_fame_for_items(*items_ids, 'accessories')
+    items_ids = items.get_items_ids_for_category_or_subcategory(*craftable_subcategories, 'accessories')
+    # merged into the existing file, it keeps values of items which are not scraped this time
+    crafting_fame_dict = _load_crafting_fame_file()
+    items_to_scrape = _select_items_to_scrape(items_ids, crafting_fame_dict, args.refresh, args.retry_missing)
+    logging.info(f'{len(items_to_scrape)} of {len(items_ids)} items to scrape')
+    _get_crafting_fame_for_items(items_to_scrape, _PageCache(args.cache_dir, args.cache_days), args.workers,
+                                 args.offline, crafting_fame_dict)
     _save_crafting_fame_to_file(crafting_fame_dict)
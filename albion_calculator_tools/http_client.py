@@ -0,0 +1,45 @@
+import logging
+import random
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# rate limiting and server errors are worth another try, other statuses won't change
+_RETRIED_STATUSES = {429, 500, 502, 503, 504}
+
+
+def create_session(pool_size: int) -> requests.Session:
+    # connections are reused by all threads, one per worker is enough
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_with_retries(session: requests.Session, url: str, retries: int, backoff: float, timeout: float,
+                     **kwargs) -> requests.Response:
+    # exponential backoff with jitter, Retry-After is respected when the server sends it
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            delay = _backoff_delay(backoff, attempt, None)
+            logging.debug(f'{url} failed ({e}), retrying in {delay:.1f}s')
+        else:
+            if response.status_code not in _RETRIED_STATUSES or attempt == retries:
+                return response
+            delay = _backoff_delay(backoff, attempt, response.headers.get('Retry-After', None))
+            logging.debug(f'{url} returned {response.status_code}, retrying in {delay:.1f}s')
+            response.close()
+        time.sleep(delay)
+
+
+def _backoff_delay(backoff: float, attempt: int, retry_after: Optional[str]) -> float:
+    if retry_after is not None and retry_after.isdigit():
+        return float(retry_after)
+    return backoff * 2 ** attempt * random.uniform(0.5, 1.5)
@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+from typing import Optional
+
+_WEB_MODULE = 'albion_calculator_web.webapp'
+# game data and calculations, web workers should load them only when a custom calculation is requested
+_FORBIDDEN_MODULES = ['numpy', 'apscheduler', 'albion_calculator_backend.calculator',
+                      'albion_calculator_backend.items', 'albion_calculator_backend.market',
+                      'albion_calculator_backend.journals', 'albion_calculator_backend.crafting_modifiers',
+                      'albion_calculator_backend.shop_categories']
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Measure import time of the web app in fresh interpreters')
+    parser.add_argument('--module', default=_WEB_MODULE)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='number of slowest modules reported')
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='fail when median import time is longer')
+    parser.add_argument('--output', default=None, help='write JSON report to file instead of stdout')
+    return parser.parse_args()
+
+
+def _run_probe(module: str, profile_imports: bool) -> tuple[dict, str]:
+    command = [sys.executable, *(['-X', 'importtime'] if profile_imports else []), '-c', _PROBE.format(module=module)]
+    process = subprocess.run(command, capture_output=True, text=True, check=True, env=os.environ.copy())
+    return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr
+
+
+def _parse_import_times(importtime_output: str, top: int) -> list[dict]:
+    # lines look like "import time:  self [us] | cumulative | imported package"
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({'module': name.strip(), 'self_ms': int(self_us) / 1000,
+                        'cumulative_ms': int(cumulative_us) / 1000})
+    return sorted(modules, key=lambda module: module['self_ms'], reverse=True)[:top]
+
+
+def _measure(module: str, repeat: int, top: int) -> dict:
+    # the first run only warms up bytecode caches
+    _run_probe(module, profile_imports=False)
+    runs = [_run_probe(module, profile_imports=False)[0] for _ in range(repeat)]
+    probe, importtime_output = _run_probe(module, profile_imports=True)
+    loaded_modules = set(probe['modules'])
+    return {'module': module,
+            'median_seconds': round(statistics.median(run['seconds'] for run in runs), 4),
+            'min_seconds': round(min(run['seconds'] for run in runs), 4),
+            'modules_count': len(loaded_modules),
+            'forbidden_modules': [name for name in _FORBIDDEN_MODULES if name in loaded_modules],
+            'slowest_modules': _parse_import_times(importtime_output, top)}
+
+
+def _write_report(report: dict, output_file: Optional[str]) -> None:
+    output = json.dumps(report, indent=1)
+    if output_file is None:
+        print(output)
+        return
+    with open(output_file, 'w') as f:
+        f.write(output)
+
+
+def main() -> None:
+    args = _parse_args()
+    result = _measure(args.module, args.repeat, args.top)
+    report = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'result': result}
+    _write_report(report, args.output)
+    if result['forbidden_modules']:
+        sys.exit(f'{args.module} imports {", ".join(result["forbidden_modules"])}')
+    if args.max_seconds is not None and result['median_seconds'] > args.max_seconds:
+        sys.exit(f'{args.module} imports in {result["median_seconds"]}s, limit is {args.max_seconds}s')
+
+
+if __name__ == '__main__':
+    main()
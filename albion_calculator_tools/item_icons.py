@@ -1,27 +1,181 @@
+import argparse
+import json
 import logging
-import shutil
+import math
+import os
+import pathlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
 import requests
 
 from albion_calculator_backend import items
+from albion_calculator_tools import http_client
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 URL = 'https://render.albiononline.com/v1/item/{item_id}.png'
-ICON_FILENAME = 'resources/icons/{item_id}.png'
+
+_STATIC_DIRECTORY = pathlib.Path(__file__).parent.parent / 'albion_calculator_web/resources/static'
+_ICONS_DIRECTORY = _STATIC_DIRECTORY / 'icons'
+# outside of the static folder so it isn't served
+_MANIFEST_FILE = _STATIC_DIRECTORY.parent / 'icons_manifest.json'
+_SPRITES_DIRECTORY = 'sprites'
+_MANIFEST_SAVE_INTERVAL = 100
+
+DOWNLOADED, NOT_MODIFIED, SKIPPED, FAILED = 'downloaded', 'not_modified', 'skipped', 'failed'
+
+
+def download_icons(items_ids: list[str], url: str = URL, directory: pathlib.Path = _ICONS_DIRECTORY,
+                   manifest_file: pathlib.Path = _MANIFEST_FILE, workers: int = 8, retries: int = 3,
+                   backoff: float = 0.5, timeout: float = 30, size: int = 100,
+                   only_missing: bool = False) -> dict[str, int]:
+    # the manifest remembers validators of downloaded icons, reruns revalidate them or skip them with only_missing
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = _load_manifest(manifest_file)
+    results = {DOWNLOADED: 0, NOT_MODIFIED: 0, SKIPPED: 0, FAILED: 0}
+    pending_ids = []
+    for item_id in items_ids:
+        if only_missing and item_id in manifest and (directory / f'{item_id}.png').exists():
+            results[SKIPPED] += 1
+        else:
+            pending_ids.append(item_id)
+    session = http_client.create_session(workers)
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {executor.submit(download_icon, session, item_id, url, directory, manifest.get(item_id, None),
+                                   retries, backoff, timeout, size): item_id for item_id in pending_ids}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            item_id = futures[future]
+            try:
+                result, validators = future.result()
+            except requests.RequestException as e:
+                logging.error(f'{item_id}: {e}')
+                result, validators = FAILED, None
+            results[result] += 1
+            if validators is not None:
+                manifest[item_id] = validators
+            if completed % _MANIFEST_SAVE_INTERVAL == 0:
+                _save_manifest(manifest, manifest_file)
+                logging.info(f'{completed}/{len(pending_ids)} icons processed')
+    _save_manifest(manifest, manifest_file)
+    logging.info(f'Icons: {results}')
+    return results
+
+
+def download_icon(session: requests.Session, item_id: str, url: str, directory: pathlib.Path,
+                  validators: Optional[dict], retries: int, backoff: float, timeout: float,
+                  size: int) -> tuple[str, Optional[dict]]:
+    filename = directory / f'{item_id}.png'
+    headers = _conditional_headers(validators) if validators and filename.exists() else {}
+    with http_client.get_with_retries(session, url.format(item_id=item_id), retries, backoff, timeout,
+                                      params={'size': size}, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            return NOT_MODIFIED, validators
+        if not response.ok:
+            logging.error(f'{item_id}: {response.status_code} {response.reason}')
+            return FAILED, None
+        # written next to the target first, an interrupted download never leaves a truncated icon
+        temporary_file = filename.with_suffix('.png.tmp')
+        with open(temporary_file, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+        os.replace(temporary_file, filename)
+        return DOWNLOADED, {'etag': response.headers.get('ETag', None),
+                            'last_modified': response.headers.get('Last-Modified', None)}
+
+
+def _conditional_headers(validators: dict) -> dict[str, str]:
+    headers = {}
+    if validators.get('etag', None):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified', None):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def _load_manifest(manifest_file: pathlib.Path) -> dict[str, dict]:
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest: dict[str, dict], manifest_file: pathlib.Path) -> None:
+    temporary_file = manifest_file.with_suffix('.tmp')
+    with open(temporary_file, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary_file, manifest_file)
+
+
+def build_sprites(cell_size: int, sheet_size: int) -> None:
+    # icons of one subcategory share sheets, so a page filtered by category needs one or two of them
+    if Image is None:
+        raise RuntimeError('Building sprites requires Pillow (pip install Pillow)')
+    sprites_directory = _STATIC_DIRECTORY / _SPRITES_DIRECTORY
+    sprites_directory.mkdir(parents=True, exist_ok=True)
+    for old_sheet in sprites_directory.glob('icons_*.png'):
+        old_sheet.unlink()
+    manifest = {'sheets': [], 'icons': {}}
+    for subcategory, items_ids in sorted(_group_icons_by_subcategory().items()):
+        for start in range(0, len(items_ids), sheet_size):
+            sheet_items_ids = items_ids[start:start + sheet_size]
+            sheet_filename = f'{_SPRITES_DIRECTORY}/icons_{len(manifest["sheets"])}.png'
+            columns, rows = _build_sheet(sheet_items_ids, cell_size, _STATIC_DIRECTORY / sheet_filename)
+            for position, item_id in enumerate(sheet_items_ids):
+                manifest['icons'][item_id] = [len(manifest['sheets']), position % columns, position // columns]
+            manifest['sheets'].append({'file': sheet_filename, 'columns': columns, 'rows': rows})
+    with open(sprites_directory / 'icons.json', 'w') as f:
+        json.dump(manifest, f)
+    logging.info(f'{len(manifest["icons"])} icons packed into {len(manifest["sheets"])} sprite sheets')
+
+
+def _group_icons_by_subcategory() -> dict[str, list[str]]:
+    grouped = {}
+    for item_id in items.get_all_items_ids():
+        if (_ICONS_DIRECTORY / f'{item_id}.png').exists():
+            grouped.setdefault(items.get_item_subcategory(item_id), []).append(item_id)
+    return grouped
+
+
+def _build_sheet(items_ids: list[str], cell_size: int, filename: pathlib.Path) -> tuple[int, int]:
+    columns = math.ceil(math.sqrt(len(items_ids)))
+    rows = math.ceil(len(items_ids) / columns)
+    sheet = Image.new('RGBA', (columns * cell_size, rows * cell_size))
+    for position, item_id in enumerate(items_ids):
+        with Image.open(_ICONS_DIRECTORY / f'{item_id}.png') as icon:
+            icon = icon.convert('RGBA').resize((cell_size, cell_size), Image.LANCZOS)
+            sheet.paste(icon, ((position % columns) * cell_size, (position // columns) * cell_size))
+    sheet.save(filename, optimize=True)
+    return columns, rows
 
 
-def download_icon(item_id):
-    url = URL.format(item_id=item_id)
-    response = requests.get(url, stream=True, params={'size': 100})
-    if not response.ok:
-        logging.error(f'{response.status_code} {response.text}')
-        return
-    response.raw.decode_content = True
-    filename = ICON_FILENAME.format(item_id=item_id)
-    with open(filename, 'wb') as f:
-        shutil.copyfileobj(response.raw, f)
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Download item icons or pack them into sprite sheets')
+    parser.add_argument('--sprites', action='store_true',
+                        help='build sprite sheets from downloaded icons instead of downloading them')
+    parser.add_argument('--cell-size', type=int, default=50, help='size of a single icon in sprite sheets')
+    parser.add_argument('--sheet-size', type=int, default=256, help='maximum number of icons in a sprite sheet')
+    parser.add_argument('--url', default=URL, help='icon URL template with {item_id} placeholder')
+    parser.add_argument('--directory', type=pathlib.Path, default=_ICONS_DIRECTORY)
+    parser.add_argument('--manifest', type=pathlib.Path, default=_MANIFEST_FILE)
+    parser.add_argument('--workers', type=int, default=8, help='concurrent downloads')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--backoff', type=float, default=0.5, help='delay before the first retry in seconds')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--size', type=int, default=100, help='size of downloaded icons')
+    parser.add_argument('--only-missing', action='store_true',
+                        help="don't revalidate icons which are already downloaded")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    item_ids = items.get_all_items_ids()
-    for item_id in item_ids:
-        download_icon(item_id)
+    args = _parse_args()
+    if args.sprites:
+        build_sprites(args.cell_size, args.sheet_size)
+    else:
+        download_icons(items.get_all_items_ids(), url=args.url, directory=args.directory, manifest_file=args.manifest,
+                       workers=args.workers, retries=args.retries, backoff=args.backoff, timeout=args.timeout,
+                       size=args.size, only_missing=args.only_missing)
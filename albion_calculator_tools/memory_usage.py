@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+import platform
+import sys
+from datetime import datetime
+from typing import Optional
+
+_MEMORY_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Measure memory of web workers the way gunicorn forks them (Linux)')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--prices', choices=['none', 'fetch', 'shared'], default='shared',
+                        help='how every worker gets prices: not at all, fetched (or read from the local price cache) '
+                             'by each worker, or mapped from the ones published by the calculator worker')
+    parser.add_argument('--preload', action='store_true',
+                        help='import the web app before forking, like gunicorn --preload')
+    parser.add_argument('--output', default=None, help='write JSON report to file instead of stdout')
+    return parser.parse_args()
+
+
+def _import_webapp() -> None:
+    from albion_calculator_web import webapp  # noqa: F401
+
+
+def _load_prices(prices: str) -> None:
+    if prices == 'none':
+        return
+    from albion_calculator_backend import market
+    if prices == 'fetch':
+        market.update_prices()
+    elif prices == 'shared' and not market._load_shared_prices():
+        raise RuntimeError('No shared prices published, run the calculator worker first')
+
+
+def _start_worker(prices: str) -> tuple[int, int, int]:
+    ready_read, ready_write = os.pipe()
+    release_read, release_write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            _import_webapp()
+            _load_prices(prices)
+        except Exception as e:
+            print(f'Worker {os.getpid()} failed: {e}', file=sys.stderr, flush=True)
+            status = 1
+        os.write(ready_write, b'1')
+        os.read(release_read, 1)
+        os._exit(status)
+    return pid, ready_read, release_write
+
+
+def _read_memory(pid: int) -> dict[str, int]:
+    memory = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in _MEMORY_FIELDS:
+                memory[f'{name.lower()}_kb'] = int(value.split()[0])
+    return memory
+
+
+def _measure(workers_count: int, prices: str, preload: bool) -> dict:
+    if preload:
+        _import_webapp()
+    workers = [_start_worker(prices) for _ in range(workers_count)]
+    measurements = []
+    for pid, ready_read, _ in workers:
+        os.read(ready_read, 1)
+        measurements.append(_read_memory(pid))
+    failed = 0
+    for pid, _, release_write in workers:
+        os.write(release_write, b'1')
+        failed += os.waitpid(pid, 0)[1] != 0
+    return {'workers': workers_count,
+            'prices': prices,
+            'preload': preload,
+            'failed_workers': failed,
+            'master': _read_memory(os.getpid()),
+            'per_worker': measurements,
+            'total_rss_kb': sum(memory['rss_kb'] for memory in measurements),
+            'total_pss_kb': sum(memory['pss_kb'] for memory in measurements)}
+
+
+def main() -> None:
+    args = _parse_args()
+    report = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'result': _measure(args.workers, args.prices, args.preload)}
+    _write_report(report, args.output)
+
+
+def _write_report(report: dict, output_file: Optional[str]) -> None:
+    output = json.dumps(report, indent=1)
+    if output_file is None:
+        print(output)
+        return
+    with open(output_file, 'w') as f:
+        f.write(output)
+
+
+if __name__ == '__main__':
+    main()
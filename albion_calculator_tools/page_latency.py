@@ -0,0 +1,166 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from albion_calculator_tools import benchmark
+
+# pages of the most used calculations, every one with all categories and with a single one
+_VARIANTS = [('CRAFTING', 'TRAVEL', False), ('CRAFTING', 'NO_RISK', True), ('TRANSPORT', 'TRAVEL', False),
+             ('UPGRADE', 'NO_TRAVEL', False)]
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Measure latency of results pages served from the database, '
+                                                 'optionally while the worker writes new calculations')
+    parser.add_argument('--size', type=int, default=10000, help='number of crafting recipes to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', default=None,
+                        help='database to fill and read, e.g. a MySQL one to compare with the embedded SQLite '
+                             '(temporary SQLite file by default); its tables are dropped and created again')
+    parser.add_argument('--journal-mode', default=None, help='SQLite journal mode overriding the config, e.g. DELETE')
+    parser.add_argument('--requests', type=int, default=200, help='pages requested per measurement')
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--concurrent-writes', action='store_true',
+                        help='measure also while another process keeps writing and deleting calculations')
+    parser.add_argument('--output', default=None, help='write JSON report to file instead of stdout')
+    return parser.parse_args()
+
+
+def _configure_database(database_url: Optional[str]) -> None:
+    # must be set before the database module is imported
+    database_url = database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'page_latency.sqlite')}"
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_url
+    os.environ.setdefault('SECRET_KEY', 'page_latency')
+
+
+def _calculate(recipes_count: int, seed: int) -> list:
+    from albion_calculator_backend import calculator, items
+
+    rng = np.random.default_rng(seed)
+    benchmark._install_catalogue(benchmark._generate_catalogue(recipes_count, rng))
+    benchmark._install_synthetic_prices(items.get_all_items_ids(), rng)
+    recipes_by_type = {'TRANSPORT': items.get_all_transport_recipes(),
+                       'CRAFTING': items.get_all_crafting_recipes(),
+                       'UPGRADE': items.get_all_upgrade_recipes()}
+    return [update for recipe_type, limitation, use_focus in _VARIANTS
+            for update in calculator._calculate_profits(recipe_type, limitation, recipes_by_type[recipe_type],
+                                                        use_focus)]
+
+
+def _save(calculations_updates: list) -> float:
+    from albion_calculator_backend.database import BackendSession
+
+    start = time.perf_counter()
+    with BackendSession() as session:
+        for calculations_update in calculations_updates:
+            session.bulk_insert_calculations_update(calculations_update)
+            session.delete_previous_calculation_updates(calculations_update.type_key)
+    return time.perf_counter() - start
+
+
+def _keep_writing(calculations_updates: list, stop: multiprocessing.Event, writes: multiprocessing.Value) -> None:
+    # a new generation of every calculation replaces the previous one, like refreshes of the worker
+    while not stop.is_set():
+        _save(calculations_updates)
+        with writes.get_lock():
+            writes.value += 1
+
+
+def _pages(calculations_updates: list) -> list[dict]:
+    pages = []
+    for recipe_type, limitation, use_focus in _VARIANTS:
+        form = {'recipe_type': recipe_type, 'limitation': limitation, 'category': 'all'}
+        if use_focus:
+            form['focus'] = 'focus'
+        pages.append(form)
+        update = next(update for update in calculations_updates if update.type_key.startswith(
+            f'{recipe_type}_{limitation}_{"WITH" if use_focus else "NO"}_FOCUS'))
+        if update.profit_details:
+            pages.append(form | {'category': update.profit_details[0].product_subcategory_id})
+    return pages
+
+
+def _measure_pages(pages: list[dict], requests_count: int, per_page: int) -> dict:
+    from albion_calculator_web.webapp import app
+
+    client = app.test_client()
+    latencies = []
+    for request_number in range(requests_count):
+        form = pages[request_number % len(pages)]
+        start = time.perf_counter()
+        response = client.post(f'/results?page={request_number % 3 + 1}&per_page={per_page}', data=form)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f'{form} returned {response.status_code}')
+    milliseconds = np.array(latencies) * 1000
+    return {'requests': requests_count,
+            'median_ms': round(float(np.median(milliseconds)), 3),
+            'p95_ms': round(float(np.percentile(milliseconds, 95)), 3),
+            'max_ms': round(float(milliseconds.max()), 3)}
+
+
+def _run(args: argparse.Namespace) -> dict:
+    from albion_calculator_backend import database
+
+    if args.journal_mode:
+        database._SQLITE_CONFIG['JOURNAL_MODE'] = args.journal_mode
+    calculations_updates = _calculate(args.size, args.seed)
+    database.drop_db()
+    database.init_db()
+    insert_seconds = _save(calculations_updates)
+    pages = _pages(calculations_updates)
+    report = {'database': database.engine.dialect.name,
+              'journal_mode': _journal_mode(database.engine),
+              'profit_details_rows': sum(len(update.profit_details) for update in calculations_updates),
+              'save_seconds': round(insert_seconds, 6),
+              'idle': _measure_pages(pages, args.requests, args.per_page)}
+    if args.concurrent_writes:
+        # the writer is forked, it gets connections of its own
+        context = multiprocessing.get_context('fork')
+        stop, writes = context.Event(), context.Value('i', 0)
+        writer = context.Process(target=_keep_writing, args=(calculations_updates, stop, writes))
+        writer.start()
+        try:
+            report['while_writing'] = _measure_pages(pages, args.requests, args.per_page)
+        finally:
+            stop.set()
+            writer.join()
+        report['while_writing']['generations_written'] = writes.value
+        report['writer_exit_code'] = writer.exitcode
+    return report
+
+
+def _journal_mode(engine) -> Optional[str]:
+    if engine.dialect.name != 'sqlite':
+        return None
+    with engine.connect() as connection:
+        return connection.exec_driver_sql('PRAGMA journal_mode').scalar()
+
+
+def main() -> None:
+    args = _parse_args()
+    _configure_database(args.database_url)
+    report = {'revision': benchmark._git_revision(),
+              'timestamp': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'recipes': args.size,
+              'per_page': args.per_page,
+              **_run(args)}
+    output = json.dumps(report, indent=1)
+    if args.output is None:
+        print(output)
+        return
+    with open(args.output, 'w') as f:
+        f.write(output)
+
+
+if __name__ == '__main__':
+    main()
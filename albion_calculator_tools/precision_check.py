@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from albion_calculator_tools import benchmark
+
+_PRECISIONS = ['float64', 'float32']
+# silver values are saved as ints, a difference of a single silver is rounding of the last digit
+_SILVER_FIELDS = ['final_product_price', 'ingredients_total_cost', 'profit_without_journals', 'profit_with_journals']
+# percentages are rounded to 2 decimal places, their differences aren't exact
+_EPSILON = 1e-9
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Compare calculations in float32 with float64 on synthetic data')
+    parser.add_argument('--size', type=int, default=10000, help='number of crafting recipes to generate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--relative-tolerance', type=float, default=1e-5,
+                        help='allowed relative difference of silver values, at least 1 silver is always allowed')
+    parser.add_argument('--percentage-tolerance', type=float, default=0.01,
+                        help='allowed difference of profit percentages, also of rows ranked at the same position')
+    parser.add_argument('--output', default=None, help='write JSON report to file instead of stdout')
+    parser.add_argument('--run', choices=_PRECISIONS, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _run_calculations(recipes_count: int, seed: int) -> dict:
+    # runs in a child process, the precision is read by market when it's imported
+    from albion_calculator_backend import calculator, calculations_reader, market, items
+
+    rng = np.random.default_rng(seed)
+    benchmark._install_catalogue(benchmark._generate_catalogue(recipes_count, rng))
+    benchmark._install_synthetic_prices(items.get_all_items_ids(), rng)
+
+    recipes_by_type = {'TRANSPORT': items.get_all_transport_recipes(),
+                       'CRAFTING': items.get_all_crafting_recipes(),
+                       'CHAIN': items.get_all_crafting_recipes(),
+                       'UPGRADE': items.get_all_upgrade_recipes()}
+    calculations, seconds = {}, {}
+    for recipe_type, limitation, use_focus in benchmark._VARIANTS:
+        key = calculations_reader.create_calculation_key(limitation, recipe_type, use_focus)
+        start = time.perf_counter()
+        updates = calculator._calculate_profits(recipe_type, limitation, recipes_by_type[recipe_type], use_focus)
+        seconds[key] = time.perf_counter() - start
+        for update in updates:
+            calculations[update.type_key] = [_describe_profit_details(details) for details in update.profit_details]
+    return {'precision': str(market.PRICE_DTYPE),
+            'calculate_profits_seconds': round(sum(seconds.values()), 6),
+            'prices_kb': sum(prices.nbytes for prices in market._estimated_real_prices.values()) // 1024,
+            'peak_rss_kb': benchmark._peak_rss_kb(),
+            'calculations': calculations}
+
+
+def _describe_profit_details(details) -> dict:
+    return {'recipe': [details.product_id, str(details.recipe_type), details.production_city,
+                       details.destination_city, *[ingredient.item_id for ingredient in details.ingredients_details]],
+            'profit_percentage': details.profit_percentage,
+            **{field: getattr(details, field) for field in _SILVER_FIELDS}}
+
+
+def _run_child(precision: str, args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, f'{precision}.json')
+        environment = os.environ | {'ALBION_CALCULATOR_PRECISION': precision,
+                                    'SQLALCHEMY_DATABASE_URI': os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite://')}
+        subprocess.run([sys.executable, '-m', 'albion_calculator_tools.precision_check', '--run', precision,
+                        '--size', str(args.size), '--seed', str(args.seed), '--output', output],
+                       env=environment, check=True)
+        with open(output) as f:
+            return json.load(f)
+
+
+def _compare_calculation(reference: list[dict], compared: list[dict], relative_tolerance: float,
+                         percentage_tolerance: float) -> dict:
+    # rows swapped between positions only matter if their profit percentages really differ
+    rank_mismatches = [position for position, (expected, actual) in enumerate(zip(reference, compared))
+                       if expected['recipe'] != actual['recipe']
+                       and _differs(expected['profit_percentage'], actual['profit_percentage'], percentage_tolerance)]
+    compared_by_recipe = {tuple(row['recipe']): row for row in compared}
+    value_mismatches, max_silver_difference, matched = 0, 0, 0
+    for expected in reference:
+        actual = compared_by_recipe.get(tuple(expected['recipe']), None)
+        if actual is None:
+            continue
+        matched += 1
+        differences = [abs(expected[field] - actual[field]) for field in _SILVER_FIELDS]
+        max_silver_difference = max(max_silver_difference, *differences)
+        if (any(difference > max(1, relative_tolerance * abs(expected[field]))
+                for difference, field in zip(differences, _SILVER_FIELDS))
+                or _differs(expected['profit_percentage'], actual['profit_percentage'], percentage_tolerance)):
+            value_mismatches += 1
+    return {'rows': len(reference),
+            'same_order': [row['recipe'] for row in reference] == [row['recipe'] for row in compared],
+            'rank_mismatches': len(rank_mismatches) + abs(len(reference) - len(compared)),
+            'first_rank_mismatch': rank_mismatches[0] if rank_mismatches else None,
+            'matched_rows': matched,
+            'value_mismatches': value_mismatches,
+            'max_silver_difference': max_silver_difference}
+
+
+def _differs(expected: float, actual: float, tolerance: float) -> bool:
+    return abs(expected - actual) > tolerance + _EPSILON
+
+
+def _create_report(reference: dict, compared: dict, args: argparse.Namespace) -> dict:
+    calculations = {key: _compare_calculation(rows, compared['calculations'].get(key, []),
+                                              args.relative_tolerance, args.percentage_tolerance)
+                    for key, rows in reference['calculations'].items()}
+    passed = all(comparison['rank_mismatches'] == 0 and comparison['value_mismatches'] == 0
+                 for comparison in calculations.values())
+    summary = {precision['precision']: {field: precision[field]
+                                        for field in ['calculate_profits_seconds', 'prices_kb', 'peak_rss_kb']}
+               for precision in (reference, compared)}
+    return {'recipes': args.size,
+            'seed': args.seed,
+            'passed': passed,
+            'speedup': round(reference['calculate_profits_seconds'] / compared['calculate_profits_seconds'], 3),
+            'prices_memory_ratio': round(compared['prices_kb'] / max(reference['prices_kb'], 1), 3),
+            'peak_rss_ratio': round(compared['peak_rss_kb'] / reference['peak_rss_kb'], 3),
+            'precisions': summary,
+            'calculations': calculations}
+
+
+def main() -> None:
+    args = _parse_args()
+    if args.run is not None:
+        result = _run_calculations(args.size, args.seed)
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+        return
+    reference, compared = (_run_child(precision, args) for precision in _PRECISIONS)
+    report = _create_report(reference, compared, args)
+    output = json.dumps(report, indent=1)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
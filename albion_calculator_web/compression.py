@@ -0,0 +1,67 @@
+import gzip
+from typing import Optional
+
+from flask import Flask, request, Response
+
+from albion_calculator_backend import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_COMPRESSION_CONFIG = config.CONFIG['APP']['WEBAPP'].get('COMPRESSION', {})
+
+_MIN_SIZE = _COMPRESSION_CONFIG.get('MIN_SIZE', 1024)
+_GZIP_LEVEL = _COMPRESSION_CONFIG.get('GZIP_LEVEL', 6)
+_BROTLI_QUALITY = _COMPRESSION_CONFIG.get('BROTLI_QUALITY', 5)
+# static files are sent by send_file and never compressed here, see _is_compressible
+_MIMETYPES = set(_COMPRESSION_CONFIG.get('MIMETYPES', ['text/html', 'application/json']))
+
+
+def init_app(app: Flask) -> None:
+    # registered after request metrics so they record compressed sizes
+    app.after_request(_compress_response)
+
+
+def _compress_response(response: Response) -> Response:
+    if not _is_compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return response
+    data = response.get_data()
+    response.set_data(brotli.compress(data, quality=_BROTLI_QUALITY) if encoding == 'br'
+                      else gzip.compress(data, compresslevel=_GZIP_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    if response.get_etag()[0] is not None:
+        # the representation differs, a strong validator of the uncompressed one would be wrong
+        response.set_etag(response.get_etag()[0], weak=True)
+    return response
+
+
+def _is_compressible(response: Response) -> bool:
+    # files sent by send_file are streamed, static assets get cached by the browser anyway
+    return (response.status_code == 200
+            and not response.direct_passthrough
+            and not response.is_streamed
+            and 'Content-Encoding' not in response.headers
+            and response.mimetype in _MIMETYPES
+            and (response.calculate_content_length() or 0) >= _MIN_SIZE)
+
+
+def _choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(','):
+        encoding, _, parameters = part.strip().partition(';')
+        quality = parameters.strip()[2:] if parameters.strip().startswith('q=') else '1'
+        try:
+            accepted[encoding.strip().lower()] = float(quality)
+        except ValueError:
+            continue
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
@@ -7,7 +7,8 @@ from sqlalchemy.orm import Query
 from albion_calculator_backend.database_models import CalculationsUpdate, ProfitDetails
 
 
-def find_calculations_for_key_and_category(key: str, category: str) -> Tuple[Query, datetime]:
+def find_calculations_for_key_and_category(key: str, category: str, min_volume: float = 0,
+                                           ranking: str = 'PROFIT_PERCENTAGE') -> Tuple[Query, datetime]:
     from albion_calculator_web.webapp import app
     calculation_update = app.session.query(CalculationsUpdate).filter_by(type_key=key) \
         .order_by(desc(CalculationsUpdate.update_time)).first()
@@ -17,4 +18,10 @@ def find_calculations_for_key_and_category(key: str, category: str) -> Tuple[Que
     else:
         profit_details = app.session.query(ProfitDetails) \
             .filter_by(calculations_updates_id=calculation_update.id)
-    return profit_details, calculation_update.update_time
+    if min_volume > 0:
+        profit_details = profit_details.filter(ProfitDetails.sellable_volume >= min_volume)
+    # saved in the order of the ranking chosen by the calculator, daily profit can be asked for regardless
+    if ranking == 'DAILY_PROFIT':
+        return profit_details.order_by(desc(ProfitDetails.daily_profit)), calculation_update.update_time
+    # explicit, the database could return rows in the order of an index used for filtering
+    return profit_details.order_by(ProfitDetails.id), calculation_update.update_time
@@ -0,0 +1,150 @@
+import bisect
+import hmac
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import Flask, g, request, Response, has_app_context, before_render_template, template_rendered, abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from albion_calculator_backend import config
+
+_WINDOW_SIZE = config.CONFIG['APP']['WEBAPP'].get('REQUEST_METRICS_WINDOW', 1000)
+# /metrics answers only requests with this bearer token, or anyone with PUBLIC_METRICS, otherwise it doesn't exist
+_METRICS_TOKEN = os.environ.get('METRICS_TOKEN', None)
+_PUBLIC_METRICS = config.CONFIG['APP']['WEBAPP'].get('PUBLIC_METRICS', False)
+_QUANTILES = (0.5, 0.9, 0.99)
+_MEASURES = ('request_seconds', 'db_seconds', 'render_seconds', 'sql_statements', 'response_bytes')
+_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# upper bounds of histogram buckets of every measure
+_BUCKETS = (_SECONDS_BUCKETS, _SECONDS_BUCKETS, _SECONDS_BUCKETS, (1, 2, 5, 10, 20, 50, 100),
+            (1024, 4096, 16384, 65536, 262144, 1048576))
+_IGNORED_ENDPOINTS = {'metrics', 'static'}
+
+_lock = threading.Lock()
+
+# everything is kept per gunicorn worker process and labelled with its pid; a scrape reaches one of the workers,
+# quantiles of recent requests are of that worker only, histograms can be aggregated over all of them, e.g.
+# histogram_quantile(0.9, sum by (le, endpoint) (rate(albion_web_request_seconds_bucket[5m])))
+_PID = os.getpid()
+
+# endpoint -> recent requests
+_requests = defaultdict(lambda: deque(maxlen=_WINDOW_SIZE))
+
+# endpoint -> counts of requests in buckets (the last one is +Inf) and sum of every measure, since the worker started
+_histograms = defaultdict(lambda: [[0] * (len(buckets) + 1) for buckets in _BUCKETS])
+_sums = defaultdict(lambda: [0.0] * len(_MEASURES))
+
+
+def init_app(app: Flask, engine: Engine) -> None:
+    os.register_at_fork(after_in_child=_reset_after_fork)
+    app.before_request(_start_timing)
+    app.after_request(_finish_timing)
+    app.add_url_rule('/metrics', 'metrics', _metrics)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+
+def _start_timing() -> None:
+    g.request_start = time.perf_counter()
+    g.db_seconds = 0.0
+    g.sql_statements = 0
+    g.render_seconds = 0.0
+
+
+def _finish_timing(response: Response) -> Response:
+    if 'request_start' not in g:
+        return response
+    request_seconds = time.perf_counter() - g.request_start
+    response_bytes = response.calculate_content_length() or 0
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={g.db_seconds * 1000:.1f};desc="{g.sql_statements} statements"',
+        f'render;dur={g.render_seconds * 1000:.1f}',
+        f'total;dur={request_seconds * 1000:.1f}'])
+    if request.endpoint is not None and request.endpoint not in _IGNORED_ENDPOINTS:
+        measured = (request_seconds, g.db_seconds, g.render_seconds, g.sql_statements, response_bytes)
+        with _lock:
+            _requests[request.endpoint].append(measured)
+            histograms, sums = _histograms[request.endpoint], _sums[request.endpoint]
+            for index, (value, buckets) in enumerate(zip(measured, _BUCKETS)):
+                histograms[index][bisect.bisect_left(buckets, value)] += 1
+                sums[index] += value
+    return response
+
+
+def _reset_after_fork() -> None:
+    # gunicorn --preload forks workers from the same parent, every one counts its own requests
+    global _PID
+    _PID = os.getpid()
+    _requests.clear()
+    _histograms.clear()
+    _sums.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_app_context() and 'request_start' in g:
+        g.db_seconds += elapsed
+        g.sql_statements += 1
+
+
+def _before_render(sender, template, context, **extra) -> None:
+    g.render_start = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra) -> None:
+    if 'render_start' in g and 'request_start' in g:
+        g.render_seconds += time.perf_counter() - g.pop('render_start')
+
+
+def _metrics() -> Response:
+    _check_metrics_access()
+    with _lock:
+        snapshot = {endpoint: list(requests) for endpoint, requests in _requests.items()}
+        histograms = {endpoint: [list(counts) for counts in histogram] for endpoint, histogram in _histograms.items()}
+        sums = {endpoint: list(values) for endpoint, values in _sums.items()}
+    lines = []
+    for index, measure in enumerate(_MEASURES):
+        lines.append(f'# TYPE albion_web_{measure} histogram')
+        for endpoint, histogram in sorted(histograms.items()):
+            labels = f'endpoint="{endpoint}",pid="{_PID}"'
+            cumulative = 0
+            for upper_bound, count in zip([*_BUCKETS[index], '+Inf'], histogram[index]):
+                cumulative += count
+                lines.append(f'albion_web_{measure}_bucket{{{labels},le="{upper_bound}"}} {cumulative}')
+            lines.append(f'albion_web_{measure}_sum{{{labels}}} {sums[endpoint][index]:g}')
+            lines.append(f'albion_web_{measure}_count{{{labels}}} {cumulative}')
+        lines.append(f'# TYPE albion_web_recent_{measure} summary')
+        for endpoint, requests in sorted(snapshot.items()):
+            labels = f'endpoint="{endpoint}",pid="{_PID}"'
+            values = sorted(request[index] for request in requests)
+            for quantile in _QUANTILES:
+                lines.append(f'albion_web_recent_{measure}{{{labels},quantile="{quantile}"}} '
+                             f'{_percentile(values, quantile):g}')
+            lines.append(f'albion_web_recent_{measure}_sum{{{labels}}} {sum(values):g}')
+            lines.append(f'albion_web_recent_{measure}_count{{{labels}}} {len(values)}')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain')
+
+
+def _check_metrics_access() -> None:
+    if _PUBLIC_METRICS:
+        return
+    authorization = request.headers.get('Authorization', '')
+    if not _METRICS_TOKEN or not hmac.compare_digest(authorization.encode(), f'Bearer {_METRICS_TOKEN}'.encode()):
+        abort(404)
+
+
+def _percentile(sorted_values: list, quantile: float) -> float:
+    # nearest-rank percentile, good enough for a window of recent requests
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(quantile * len(sorted_values))) - 1))
+    return sorted_values[index]
@@ -0,0 +1,75 @@
+import functools
+import hashlib
+import json
+import pathlib
+from typing import Optional
+
+from flask import Flask, request, Response
+
+from albion_calculator_backend import config
+
+_STATIC_ASSETS_CONFIG = config.CONFIG['APP']['WEBAPP'].get('STATIC_ASSETS', {})
+
+_VERSION_ARG = 'v'
+_VERSIONED_MAX_AGE = _STATIC_ASSETS_CONFIG.get('VERSIONED_MAX_AGE', 365 * 24 * 3600)
+_ICON_SPRITES_MANIFEST = _STATIC_ASSETS_CONFIG.get('ICON_SPRITES_MANIFEST', 'sprites/icons.json')
+
+_static_folder = None
+
+# item_id -> [sheet index, column, row], None when sprites weren't built
+_icon_sprites = None
+
+
+def init_app(app: Flask) -> None:
+    global _static_folder, _icon_sprites
+    _static_folder = pathlib.Path(app.static_folder)
+    _icon_sprites = _load_icon_sprites(_static_folder / _ICON_SPRITES_MANIFEST)
+    app.url_defaults(_add_static_version)
+    app.after_request(_cache_versioned_static)
+    app.jinja_env.globals['icon_sprite'] = get_icon_sprite
+
+
+def get_icon_sprite(item_id: str) -> Optional[dict]:
+    # position of the icon in a sprite sheet, None means the icon is served as a separate file
+    if _icon_sprites is None or item_id not in _icon_sprites['icons']:
+        return None
+    sheet_index, column, row = _icon_sprites['icons'][item_id]
+    return {'column': column, 'row': row} | _icon_sprites['sheets'][sheet_index]
+
+
+def _load_icon_sprites(manifest_file: pathlib.Path) -> Optional[dict]:
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def _add_static_version(endpoint: str, values: dict) -> None:
+    # the content hash in static urls lets browsers cache them forever, a changed file gets a new url
+    if endpoint != 'static' or 'filename' not in values or _VERSION_ARG in values:
+        return
+    version = _get_static_version(values['filename'])
+    if version is not None:
+        values[_VERSION_ARG] = version
+
+
+def _cache_versioned_static(response: Response) -> Response:
+    version = request.args.get(_VERSION_ARG, None)
+    if request.endpoint != 'static' or version is None or response.status_code not in (200, 304):
+        return response
+    if version == _get_static_version(request.view_args['filename']):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = _VERSIONED_MAX_AGE
+        response.cache_control.immutable = True
+        response.headers.pop('Expires', None)
+    return response
+
+
+@functools.lru_cache(maxsize=None)
+def _get_static_version(filename: str) -> Optional[str]:
+    path = (_static_folder / filename).resolve()
+    if _static_folder.resolve() not in path.parents or not path.is_file():
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()[:12]
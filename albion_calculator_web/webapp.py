@@ -2,13 +2,13 @@ import logging
 import logging
 import os
 
-import jinja2
 import sqlalchemy_pagination
-from flask import render_template, request, session, redirect, url_for, Flask, _app_ctx_stack
+from flask import render_template, request, session, redirect, url_for, Flask, _app_ctx_stack, jsonify
 from sqlalchemy.orm import scoped_session
 
-from albion_calculator_backend import calculator, shop_categories
-from albion_calculator_backend.database import SessionLocal
+from albion_calculator_backend import calculations_reader, cities
+from albion_calculator_backend.database import ReaderSessionLocal, reader_engine
+from albion_calculator_web import request_metrics, compression, static_assets
 
 logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
                     level=logging.DEBUG)
@@ -23,8 +23,11 @@ def create_app():
     except OSError:
         pass
 
-    app.session = scoped_session(SessionLocal, scopefunc=_app_ctx_stack.__ident_func__)
+    app.session = scoped_session(ReaderSessionLocal, scopefunc=_app_ctx_stack.__ident_func__)
     app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
+    request_metrics.init_app(app, reader_engine)
+    compression.init_app(app)
+    static_assets.init_app(app)
     return app
 
 
@@ -33,15 +36,18 @@ app = create_app()
 
 @app.context_processor
 def inject_categories() -> dict:
-    categories = {category: shop_categories.get_category_pretty_name(category) for category in
-                  shop_categories.get_craftable_shop_categories()}
-    return dict(categories=categories)
+    return dict(categories=calculations_reader.get_craftable_categories())
+
+
+@app.context_processor
+def inject_cities() -> dict:
+    return dict(cities=cities.cities_names())
 
 
 @app.context_processor
 def inject_travel_multiplier() -> dict:
-    return dict(one_tile_multiplier=calculator.ONE_TILE,
-                two_tiles_multiplier=calculator.TWO_TILES)
+    return dict(one_tile_multiplier=calculations_reader.ONE_TILE,
+                two_tiles_multiplier=calculations_reader.TWO_TILES)
 
 
 @app.teardown_appcontext
@@ -70,11 +76,14 @@ def results():
 
     if not form_data:
         return redirect(url_for('index'))
-    calculations_query, update_time = calculator.get_calculations(recipe_type=form_data.get('recipe_type', 'CRAFTING'),
-                                                                  limitation=form_data.get('limitation', 'TRAVEL'),
-                                                                  city_index=int(form_data.get('city', '0')),
-                                                                  use_focus=form_data.get('focus', False),
-                                                                  category=form_data.get('category', 'all'))
+    calculations_query, update_time = calculations_reader.get_calculations(
+        recipe_type=form_data.get('recipe_type', 'CRAFTING'),
+        limitation=form_data.get('limitation', 'TRAVEL'),
+        city_index=int(form_data.get('city', '0')),
+        use_focus=form_data.get('focus', False),
+        category=form_data.get('category', 'all'),
+        min_volume=_parse_min_volume(form_data.get('min_volume')),
+        ranking=form_data.get('ranking', 'PROFIT_PERCENTAGE'))
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 50))
     calculations = sqlalchemy_pagination.paginate(calculations_query, page, per_page)
@@ -82,6 +91,42 @@ def results():
                            calculations=calculations, update_time=update_time)
 
 
+@app.route('/custom')
+def custom_calculations():
+    # game data is loaded on the first custom calculation only, other pages don't need it; prices are only the ones
+    # published by the worker, fetching them here would block the worker process for the whole download
+    from albion_calculator_backend import calculator, market
+    if not market.ensure_prices_loaded():
+        return jsonify(error='Prices are not available yet, try again later'), 503, {'Retry-After': '60'}
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', 50))
+        min_volume = _parse_min_volume(request.args.get('min_volume'))
+        calculations = calculator.calculate_custom_profits(
+            recipe_type=request.args.get('recipe_type', 'CRAFTING'),
+            limitation=request.args.get('limitation', 'TRAVEL'),
+            travel_cost=float(request.args.get('travel_cost', calculations_reader.ONE_TILE)),
+            allowed_cities=[int(city) for city in request.args.getlist('city')],
+            use_focus=request.args.get('focus', 'false').lower() in ('1', 'true', 'focus'),
+            category=request.args.get('category', 'all'),
+            full_output=request.args.get('full', 'false').lower() in ('1', 'true'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if min_volume > 0:
+        calculations = [details for details in calculations if details.sellable_volume >= min_volume]
+    return jsonify(total=len(calculations), price_generation=market.get_price_generation(),
+                   calculations=[details.to_dict() for details in calculations[offset:offset + limit]])
+
+
+def _parse_min_volume(value) -> float:
+    # optional filter, anything which isn't a non-negative number means no filter
+    try:
+        min_volume = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return min_volume if min_volume > 0 else 0
+
+
 def paginate_calculations(calculations, page, page_size):
     start = (page - 1) * page_size
     end = page * page_size
@@ -96,4 +141,4 @@ def datetime_format(value, format="%d-%m-%y %H:%M %Z"):
     return value.strftime(format)
 
 
-jinja2.filters.FILTERS["datetime_format"] = datetime_format
+app.jinja_env.filters["datetime_format"] = datetime_format